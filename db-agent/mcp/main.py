@@ -3,18 +3,45 @@
 import sys
 import os
 import asyncio
+from contextlib import asynccontextmanager
 
 # 添加src目录到路径
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from mcp.server.fastmcp import FastMCP
 
 from src.core.mcp_tool_registry import MCPToolRegistry
 from src.core.conversation_manager import get_conversation_manager
 from src.tools.database.mcp_provider import register_database_mcp_tools
 from src.api import complete_router, demo_router
+from src.api.complete_api import get_conversation_manager as get_api_conversation_manager
+
+
+class StreamSafeGZipMiddleware:
+    """GZip压缩中间件，跳过流式（SSE）接口，避免压缩缓冲导致事件延迟送达"""
+    
+    def __init__(self, app, exclude_suffixes=("/stream",), **gzip_options):
+        self.app = app
+        self.gzip_app = GZipMiddleware(app, **gzip_options)
+        self.exclude_suffixes = exclude_suffixes
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].endswith(self.exclude_suffixes):
+            await self.app(scope, receive, send)
+        else:
+            await self.gzip_app(scope, receive, send)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建工具注册中心和对话管理器，路由通过依赖注入复用"""
+    app.state.conversation_manager = get_api_conversation_manager()
+    yield
+    app.state.conversation_manager = None
 
 
 def create_fastapi_app():
@@ -22,18 +49,25 @@ def create_fastapi_app():
     app = FastAPI(
         title="Database Explorer Agent",
         description="基于MCP架构的数据库探索智能体",
-        version="2.0.0"
+        version="2.0.0",
+        default_response_class=ORJSONResponse,
+        lifespan=lifespan
     )
     
-    # 添加CORS中间件
+    # 添加CORS中间件：固定的来源/方法/请求头白名单，预检结果由浏览器缓存一天
+    cors_origins = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000")
     app.add_middleware(
         CORSMiddleware,
-        allow_origins=["*"],
+        allow_origins=[origin.strip() for origin in cors_origins.split(",") if origin.strip()],
         allow_credentials=True,
-        allow_methods=["*"],
-        allow_headers=["*"],
+        allow_methods=["GET", "POST", "PUT", "DELETE"],
+        allow_headers=["content-type", "authorization"],
+        max_age=86400,
     )
     
+    # 压缩较大的JSON响应（对话详情、导出等重复键名多，压缩率高）
+    app.add_middleware(StreamSafeGZipMiddleware, minimum_size=1024, compresslevel=5)
+    
     # 注册API路由
     app.include_router(complete_router, prefix="/api")
     app.include_router(demo_router)
@@ -95,21 +129,39 @@ async def run_mcp_server():
     await mcp_server.run()
 
 
-def run_api_server():
-    """运行API服务器"""
+def run_api_server(workers: int = None):
+    """运行API服务器
+    
+    Args:
+        workers: 工作进程数，默认读取环境变量 API_WORKERS（默认1）
+    """
     import uvicorn
     
-    app = create_fastapi_app()
+    # 多进程时每个worker在lifespan中创建自己的对话管理器和SQLite连接；
+    # 对话读缓存是进程内的，无法感知其他worker的写入，API_WORKERS>1 时自动关闭
+    workers = workers or int(os.getenv("API_WORKERS", "1"))
+    # 写回环境变量，worker进程据此判断是否启用进程内缓存
+    os.environ["API_WORKERS"] = str(workers)
     
     print("\n启动API服务器...")
+    print(f"工作进程数: {workers}")
     print("API文档: http://localhost:8000/docs")
     print("演示页面: http://localhost:8000/demo")
     
+    # uvicorn[standard] 提供 uvloop 事件循环和 httptools 解析器，
+    # auto 在已安装时优先使用它们（uvloop不支持Windows时自动回退asyncio）
     uvicorn.run(
-        app,
+        "main:create_fastapi_app",
+        factory=True,
         host="0.0.0.0",
         port=8000,
-        reload=False
+        reload=False,
+        workers=workers,
+        loop="auto",
+        http="auto",
+        # 默认关闭逐请求访问日志（同步写终端，高并发下明显拖慢吞吐），需要排查时用环境变量开启
+        access_log=os.getenv("API_ACCESS_LOG", "false").lower() == "true",
+        log_level=os.getenv("API_LOG_LEVEL", "warning")
     )
 
 
@@ -118,7 +170,8 @@ async def run_both_servers():
     import threading
     
     # 在单独线程中运行API服务器
-    api_thread = threading.Thread(target=run_api_server, daemon=True)
+    # 子线程中无法管理多个worker进程，固定为单进程
+    api_thread = threading.Thread(target=run_api_server, kwargs={"workers": 1}, daemon=True)
     api_thread.start()
     
     # 在主线程中运行MCP服务器
@@ -18,15 +18,22 @@
 """
 
 from __future__ import annotations
+from dataclasses import dataclass
 from pathlib import Path
 import argparse
-from typing import List
+import re
+from typing import Iterator, List
 
 from paddleocr import PPStructureV3
 import paddle
 import gc
+import functools
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+import numpy as np
 # 新增：服务相关依赖
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 import threading
 
 try:
@@ -38,6 +45,48 @@ except Exception:
     _FASTAPI_AVAILABLE = False
 
 
+# 构造 PPStructureV3 的推理选项（须在首次调用 _get_pipeline 之前通过 configure_pipeline 设置）
+_PIPELINE_OPTIONS: Dict[str, Any] = {}
+
+
+def configure_pipeline(precision: str) -> None:
+    """设置推理精度：fp16 通过 TensorRT 子图以半精度推理（需GPU及支持TensorRT的Paddle）"""
+    _PIPELINE_OPTIONS.clear()
+    if precision == "fp16":
+        _PIPELINE_OPTIONS.update(use_tensorrt=True, precision="fp16")
+
+
+def resolve_precision(precision: str, device: str) -> str:
+    """解析 --precision：auto 时在计算能力 >= 7.0（Volta及以上，具备Tensor Core）的GPU上使用fp16"""
+    if device != "gpu":
+        if precision == "fp16":
+            print("警告：fp16 仅支持GPU推理，回退到fp32。")
+        return "fp32"
+    if precision != "auto":
+        return precision
+    try:
+        major, _ = paddle.device.cuda.get_device_capability()
+    except Exception:
+        return "fp32"
+    return "fp16" if major >= 7 else "fp32"
+
+
+@functools.lru_cache(maxsize=1)
+def _get_pipeline() -> PPStructureV3:
+    """获取进程内唯一的 PPStructureV3 实例（首次调用时加载模型权重）"""
+    return PPStructureV3(**_PIPELINE_OPTIONS)
+
+
+def warmup_pipeline(pipeline: PPStructureV3) -> None:
+    """用一张空白小图跑一次推理，提前完成算子初始化/显存分配，降低首个请求延迟"""
+    blank = np.full((64, 64, 3), 255, dtype=np.uint8)
+    try:
+        for _ in pipeline.predict(input=blank):
+            pass
+    except Exception as e:
+        print(f"警告：模型预热失败（不影响服务）：{e}")
+
+
 def build_out_dir(pdf_path: Path, output_base: Path, root_base: Path) -> Path:
     try:
         rel = pdf_path.resolve().relative_to(root_base.resolve())
@@ -49,64 +98,194 @@ def build_out_dir(pdf_path: Path, output_base: Path, root_base: Path) -> Path:
     return out_dir
 
 
-def process_pdf(pipeline: PPStructureV3, input_file: Path, output_base: Path, root_base: Path) -> Path:
+def predict_pdf(pipeline: PPStructureV3, input_file: Path) -> Tuple[str, List[Dict[str, Any]]]:
+    """对单个 PDF 做结构化识别，返回 (聚合后的 Markdown 文本, 各页图片字典列表)"""
     output = pipeline.predict(input=str(input_file))
 
-    markdown_list = []
-    markdown_images = []
+    markdown_list: List[Dict[str, Any]] = []
+    markdown_images: List[Dict[str, Any]] = []
+    append_markdown = markdown_list.append
+    append_images = markdown_images.append
 
+    # 单次遍历收集各页结果；只保留确有图片的页，写出阶段无需再跳过空字典
     for res in output:
         md_info = res.markdown
-        markdown_list.append(md_info)
-        markdown_images.append(md_info.get("markdown_images", {}))
+        append_markdown(md_info)
+        images = md_info.get("markdown_images")
+        if images:
+            append_images(images)
 
     markdown_texts = pipeline.concatenate_markdown_pages(markdown_list)
+    return markdown_texts, markdown_images
 
-    out_dir = build_out_dir(input_file, output_base, root_base)
-    out_dir.mkdir(parents=True, exist_ok=True)
 
-    mkd_file_path = out_dir / f"{input_file.stem}.md"
-    with open(mkd_file_path, "w", encoding="utf-8") as f:
-        f.write(markdown_texts)
+# 输出文件写入线程池（进程内共享）
+_io_pool = ThreadPoolExecutor(max_workers=4)
+
+
+@dataclass(frozen=True)
+class ImageOptions:
+    """图片输出选项：format 为 keep 时按原扩展名保存，否则统一转码为指定格式"""
+    format: str = "keep"
+    quality: int = 85
+
 
+_IMAGE_FORMATS = {
+    "png": ("PNG", ".png"),
+    "webp": ("WEBP", ".webp"),
+    "jpeg": ("JPEG", ".jpg"),
+}
+
+
+def _save_image(image: Any, file_path: Path, options: ImageOptions) -> None:
+    if options.format == "keep":
+        image.save(file_path)
+        return
+    pil_format, _ = _IMAGE_FORMATS[options.format]
+    if pil_format == "PNG":
+        image.save(file_path, pil_format)
+        return
+    if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    save_kwargs: Dict[str, Any] = {"quality": options.quality}
+    if pil_format == "WEBP":
+        save_kwargs["method"] = 4
+    image.save(file_path, pil_format, **save_kwargs)
+
+
+def write_outputs(input_file: Path, out_dir: Path, markdown_texts: str, markdown_images: List[Dict[str, Any]],
+                  image_options: ImageOptions = ImageOptions()) -> Path:
+    """将 Markdown 与其引用的图片写入输出目录"""
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    # 转码时改写图片扩展名，并同步替换 Markdown 中的引用路径
+    renamed: Dict[str, str] = {}
+    if image_options.format != "keep":
+        _, ext = _IMAGE_FORMATS[image_options.format]
+        for item in markdown_images:
+            for path in item:
+                new_path = str(Path(path).with_suffix(ext))
+                if new_path != path:
+                    renamed[path] = new_path
+        if renamed:
+            pattern = re.compile("|".join(re.escape(path) for path in sorted(renamed, key=len, reverse=True)))
+            markdown_texts = pattern.sub(lambda m: renamed[m.group(0)], markdown_texts)
+
+    # 各图片的写出提交到I/O线程池并行执行（图片编码和磁盘写入期间会释放GIL），
+    # 全部完成后才返回，保证调用方拿到的输出目录已完整
+    futures = []
     for item in markdown_images:
-        if item:
-            for path, image in item.items():
-                file_path = out_dir / path
-                file_path.parent.mkdir(parents=True, exist_ok=True)
-                image.save(file_path)
+        for path, image in item.items():
+            file_path = out_dir / renamed.get(path, path)
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            futures.append(_io_pool.submit(_save_image, image, file_path, image_options))
 
+    wait(futures)
+    for future in futures:
+        future.result()
+
+    # Markdown 最后写出，作为该 PDF 抽取完成的标记（断点续跑据此判断）
+    mkd_file_path = out_dir / f"{input_file.stem}.md"
+    mkd_file_path.write_text(markdown_texts, encoding="utf-8")
     return out_dir
 
 
+def process_pdf(pipeline: PPStructureV3, input_file: Path, output_base: Path, root_base: Path,
+                image_options: ImageOptions = ImageOptions()) -> Path:
+    markdown_texts, markdown_images = predict_pdf(pipeline, input_file)
+    out_dir = build_out_dir(input_file, output_base, root_base)
+    return write_outputs(input_file, out_dir, markdown_texts, markdown_images, image_options)
+
+
+def _prefetch_file(path: Path) -> None:
+    """提示内核将文件预读到页缓存，使下一个 PDF 的读取与当前推理重叠"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            else:
+                while os.read(fd, 1 << 20):
+                    pass
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+
+def _iter_pdfs(list_file: Path) -> Iterator[Path]:
+    """逐行读取列表文件，按需产出有效的 PDF 路径（不一次性载入整个列表）"""
+    with open(list_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            p = Path(line)
+            if p.suffix.lower() == ".pdf" and p.is_file():
+                yield p
+
+
+def _is_extracted(pdf_path: Path, out_dir: Path) -> bool:
+    """输出目录中已有不早于源 PDF 的 Markdown 文件，视为已抽取"""
+    md_file = out_dir / f"{pdf_path.stem}.md"
+    try:
+        return md_file.stat().st_mtime >= pdf_path.stat().st_mtime
+    except OSError:
+        return False
+
+
+def _init_worker(device: str, num_gpus: int, counter, precision: str) -> None:
+    """进程池初始化：每个工作进程绑定设备（GPU模式下按进程序号轮流分配到各卡）并设置推理精度"""
+    configure_pipeline(precision)
+    with counter.get_lock():
+        worker_idx = counter.value
+        counter.value += 1
+    if device == "gpu" and num_gpus > 0:
+        paddle.set_device(f"gpu:{worker_idx % num_gpus}")
+    else:
+        paddle.set_device("cpu")
+
+
+def _process_pdf_task(task: Tuple[Path, Path, Path, bool, ImageOptions]) -> Tuple[Path, Optional[str]]:
+    """进程池任务：在工作进程内用本进程的 pipeline 处理单个 PDF，返回 (路径, 错误信息)"""
+    pdf_path, output_base, root_base, gc_after_pdf, image_options = task
+    try:
+        process_pdf(_get_pipeline(), pdf_path, output_base, root_base, image_options)
+        if gc_after_pdf:
+            gc.collect()
+        return pdf_path, None
+    except Exception as e:
+        return pdf_path, str(e)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Batch extract PDFs with PaddleOCR PPStructureV3")
     parser.add_argument("--list-file", default="/home/xxx/liukeyu/guangke/unreadable_pdfs.txt", help="包含待抽取 PDF 绝对路径的 txt 文件，一行一个路径")
     parser.add_argument("--output-dir", default="/home/xxx/liukeyu/guangke/output_ocr", help="输出目录")
     parser.add_argument("--root-base", default="/home/xxx/liukeyu/guangke/广科院资料", help="用于保持原有目录结构的根目录")
     parser.add_argument("--device", default="auto", choices=["auto", "gpu", "cpu"], help="选择设备：gpu/cpu/auto（默认auto，优先gpu可用则用gpu）")
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "fp16", "auto"], help="推理精度（默认fp32；fp16使用TensorRT半精度推理，需GPU；auto在Volta及以上GPU自动选择fp16）")
     parser.add_argument("--gc-after-pdf", action="store_true", help="每个PDF完成后触发一次垃圾回收以降低内存峰值")
+    parser.add_argument("--image-format", default="keep", choices=["keep", "png", "webp", "jpeg"], help="图片保存格式（默认keep保持原扩展名；webp/jpeg编码更快、体积更小）")
+    parser.add_argument("--image-quality", type=int, default=85, help="webp/jpeg 的压缩质量（默认85）")
+    parser.add_argument("--force", action="store_true", help="重新抽取所有PDF（默认跳过已有最新输出的PDF，便于中断后续跑）")
+    parser.add_argument("--workers", type=int, default=1, help="批量模式的并行进程数（默认1；每个进程各自加载一份模型，GPU模式下按进程轮流分配到各卡）")
     # 新增：服务模式
     parser.add_argument("--serve", action="store_true", help="以HTTP接口模式启动服务，提供单文件抽取接口")
     parser.add_argument("--host", default="127.0.0.1", help="服务绑定地址（默认127.0.0.1）")
     parser.add_argument("--port", type=int, default=8000, help="服务端口（默认8000）")
+    parser.add_argument("--max-concurrency", type=int, default=2, help="服务模式下同时处理的请求数上限（默认2；推理串行，写出与下一请求的推理并行）")
+    parser.add_argument("--no-warmup", action="store_true", help="服务模式下启动时不进行模型预热")
     args = parser.parse_args()
 
     list_file = Path(args.list_file)
+    image_options = ImageOptions(format=args.image_format, quality=args.image_quality)
     output_dir = Path(args.output_dir)
     root_base = Path(args.root_base)
 
     if not list_file.exists():
         raise SystemExit(f"找不到列表文件: {list_file}")
 
-    with open(list_file, "r", encoding="utf-8") as f:
-        pdf_paths: List[Path] = [Path(line.strip()) for line in f if line.strip()]
-
-    pdf_paths = [p for p in pdf_paths if p.exists() and p.is_file() and p.suffix.lower() == ".pdf"]
-
-    if not pdf_paths:
-        raise SystemExit("列表中没有有效的 PDF 路径")
-
     # 设备选择：优先使用GPU（如可用）
     chosen = "cpu"
     if args.device in ("auto", "gpu"):
@@ -130,6 +309,10 @@ def main():
         cur_dev = chosen
     print(f"使用设备: {cur_dev}")
 
+    precision = resolve_precision(args.precision, chosen)
+    configure_pipeline(precision)
+    print(f"推理精度: {precision}")
+
     # 服务模式：启动FastAPI，仅处理单文件抽取
     if args.serve:
         if not _FASTAPI_AVAILABLE:
@@ -137,8 +320,11 @@ def main():
 
         app = FastAPI(title="PDF Extractor API", version="1.0.0")
         state: Dict[str, Any] = {
-            "pipeline": PPStructureV3(),
-            "lock": threading.Lock(),
+            "pipeline": _get_pipeline(),
+            # 同时处理的请求数上限：限制内存中同时存在的识别结果
+            "sem": threading.BoundedSemaphore(max(1, args.max_concurrency)),
+            # 推理本身仍串行（pipeline 非线程安全），结果写出在锁外进行，可与下一个请求的推理重叠
+            "infer_lock": threading.Lock(),
             "output_dir": output_dir,
             "root_base": root_base,
             "gc_after_pdf": args.gc_after_pdf,
@@ -158,9 +344,18 @@ def main():
             out_base = Path(req.output_dir) if req.output_dir else state["output_dir"]
             root_base_local = Path(req.root_base) if req.root_base else state["root_base"]
 
-            with state["lock"]:
+            with state["sem"]:
                 try:
-                    out_dir_path = process_pdf(state["pipeline"], pdf_path, out_base, root_base_local)
+                    with state["infer_lock"]:
+                        markdown_texts, markdown_images = predict_pdf(state["pipeline"], pdf_path)
+                    out_dir_path = write_outputs(
+                        pdf_path,
+                        build_out_dir(pdf_path, out_base, root_base_local),
+                        markdown_texts,
+                        markdown_images,
+                        image_options,
+                    )
+                    del markdown_texts, markdown_images
                     if state["gc_after_pdf"]:
                         gc.collect()
                 except Exception as e:
@@ -175,22 +370,107 @@ def main():
                 "markdown_file": str(md_file if md_file.exists() else ""),
             }
 
+        if not args.no_warmup:
+            print("模型预热中...")
+            warmup_pipeline(state["pipeline"])
+
         uvicorn.run(app, host=args.host, port=args.port)
         return
 
-    pipeline = PPStructureV3()
-
     failures: List[str] = []
-    print(f"开始抽取，共 {len(pdf_paths)} 个 PDF，输出目录：{output_dir}")
-    for idx, p in enumerate(pdf_paths, 1):
-        try:
-            print(f"[{idx}/{len(pdf_paths)}] 处理：{p}")
-            out_dir_path = process_pdf(pipeline, p, output_dir, root_base)
-            if args.gc_after_pdf:
-                gc.collect()
-        except Exception as e:
-            print(f"  -> 失败：{p} | {e}")
-            failures.append(str(p))
+    processed = 0
+    skipped = 0
+    print(f"开始抽取，输出目录：{output_dir}")
+
+    def _pending_pdfs() -> Iterator[Path]:
+        """待处理的 PDF：已有不早于源文件的输出时跳过（--force 时全部重新处理）"""
+        nonlocal skipped
+        for p in _iter_pdfs(list_file):
+            if not args.force and _is_extracted(p, build_out_dir(p, output_dir, root_base)):
+                skipped += 1
+                print(f"跳过（已抽取）：{p}")
+                continue
+            yield p
+
+    if args.workers > 1:
+        # 多进程并行：PDF之间相互独立；使用spawn避免fork继承父进程已初始化的CUDA上下文
+        num_gpus = paddle.device.cuda.device_count() if chosen == "gpu" else 0
+        ctx = multiprocessing.get_context("spawn")
+        tasks = ((p, output_dir, root_base, args.gc_after_pdf, image_options) for p in _pending_pdfs())
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(chosen, num_gpus, ctx.Value("i", 0), precision),
+        ) as executor:
+            # 有界提交：最多保持 2×workers 个任务在途，按完成顺序补充，
+            # 不会一次性遍历整个列表（及其 stat 检查）并为每个 PDF 创建 future
+            in_flight = set()
+            max_in_flight = 2 * args.workers
+            task_iter = iter(tasks)
+            exhausted = False
+            while True:
+                while not exhausted and len(in_flight) < max_in_flight:
+                    task = next(task_iter, None)
+                    if task is None:
+                        exhausted = True
+                        break
+                    in_flight.add(executor.submit(_process_pdf_task, task))
+                if not in_flight:
+                    break
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    p, error = future.result()
+                    processed += 1
+                    if error is None:
+                        print(f"[{processed}] 完成：{p}")
+                    else:
+                        print(f"[{processed}] 失败：{p} | {error}")
+                        failures.append(str(p))
+    else:
+        # 流水线：推理当前 PDF 的同时，后台线程预读下一个 PDF、写出上一个 PDF 的结果
+        pipeline = _get_pipeline()
+        pdf_iter = _pending_pdfs()
+        next_pdf = next(pdf_iter, None)
+        pending_write: Optional[Tuple[Path, Future]] = None
+
+        def _finish_pending_write() -> None:
+            if pending_write is None:
+                return
+            written_pdf, future = pending_write
+            try:
+                future.result()
+            except Exception as e:
+                print(f"  -> 写出失败：{written_pdf} | {e}")
+                failures.append(str(written_pdf))
+
+        with ThreadPoolExecutor(max_workers=2) as io_executor:
+            while next_pdf is not None:
+                p = next_pdf
+                processed += 1
+                next_pdf = next(pdf_iter, None)
+                if next_pdf is not None:
+                    io_executor.submit(_prefetch_file, next_pdf)
+                try:
+                    print(f"[{processed}] 处理：{p}")
+                    markdown_texts, markdown_images = predict_pdf(pipeline, p)
+                except Exception as e:
+                    print(f"  -> 失败：{p} | {e}")
+                    failures.append(str(p))
+                    continue
+                # 最多只保留一个未完成的写出任务，避免图片在内存中堆积
+                _finish_pending_write()
+                out_dir = build_out_dir(p, output_dir, root_base)
+                pending_write = (p, io_executor.submit(write_outputs, p, out_dir, markdown_texts, markdown_images, image_options))
+                del markdown_texts, markdown_images
+                if args.gc_after_pdf:
+                    gc.collect()
+            _finish_pending_write()
+
+    if processed == 0 and skipped == 0:
+        raise SystemExit("列表中没有有效的 PDF 路径")
+    if skipped:
+        print(f"已跳过 {skipped} 个已抽取的 PDF（使用 --force 可重新抽取）")
 
     if failures:
         fail_file = output_dir / "failed_pdfs.txt"
@@ -5,22 +5,25 @@
 支持上传图片进行OCR识别，识别结果可直接传递给大模型
 """
 
+import asyncio
 import os
+import queue
 import sys
-import tempfile
-from pathlib import Path
-from typing import Optional
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set
 import logging
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 import uvicorn
 
-# 配置日志
+# 配置日志（OCR_LOG_LEVEL=DEBUG 可查看原始识别结果等详细信息）
 logging.basicConfig(
-    level=logging.INFO,
+    level=os.getenv("OCR_LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
@@ -29,38 +32,348 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="OCR Recognition Service",
     description="图片OCR识别服务，基于PaddleOCR",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
-# 添加CORS中间件
+# 添加CORS中间件：固定的来源/方法/请求头白名单，预检结果由浏览器缓存一天
+cors_origins = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000")
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=[origin.strip() for origin in cors_origins.split(",") if origin.strip()],
+    allow_credentials=False,
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type"],
+    max_age=86400,
 )
 
-# 全局OCR引擎实例
-_ocr_engine = None
+# 压缩较大的识别结果（长文本）
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
+# 上传文件分块读取大小
+UPLOAD_CHUNK_SIZE = 64 * 1024
 
-def get_ocr_engine():
-    """获取OCR引擎实例"""
-    global _ocr_engine
-    if _ocr_engine is None:
+# 上传大小上限（MB），超出返回413
+OCR_MAX_UPLOAD_MB = float(os.getenv("OCR_MAX_UPLOAD_MB", "20"))
+MAX_UPLOAD_BYTES = int(OCR_MAX_UPLOAD_MB * 1024 * 1024)
+
+# 识别前将图片长边缩放到该像素以内（0 表示不缩放），
+# 与检测模型的 text_det_limit_side_len / text_det_limit_type="max" 保持一致
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "960"))
+
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """按Content-Length提前拒绝超大上传，避免Starlette先把整个multipart请求体落盘"""
+    content_length = request.headers.get("content-length")
+    # 额外预留一个分块大小给multipart边界及表单头
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + UPLOAD_CHUNK_SIZE:
+        return ORJSONResponse(
+            status_code=413, content={"detail": f"图片大小超过限制 ({OCR_MAX_UPLOAD_MB:g}MB)"}
+        )
+    return await call_next(request)
+
+
+# OCR引擎池大小（每个引擎独立加载模型，显存/内存占用随之线性增长）
+OCR_POOL_SIZE = max(1, int(os.getenv("OCR_POOL_SIZE", "1")))
+
+# 推理设备/精度：OCR_DEVICE=auto|gpu|cpu，OCR_PRECISION=fp32|fp16（fp16 需GPU及支持TensorRT的Paddle）
+OCR_DEVICE = os.getenv("OCR_DEVICE", "auto").lower()
+OCR_PRECISION = os.getenv("OCR_PRECISION", "fp32").lower()
+
+# 微批处理：单批最大图片数及最长等待时间（OCR_BATCH_SIZE<=1 时关闭批处理）
+OCR_BATCH_SIZE = max(1, int(os.getenv("OCR_BATCH_SIZE", "8")))
+OCR_BATCH_WAIT_MS = float(os.getenv("OCR_BATCH_WAIT_MS", "10"))
+
+# OCR引擎池及专用推理线程池
+_engine_pool: Optional[queue.Queue] = None
+_engine_pool_lock = threading.Lock()
+# 后台预热任务；预热失败后按该间隔（秒）重试，直到引擎池就绪
+_warmup_task: Optional[asyncio.Task] = None
+OCR_WARMUP_RETRY_SECONDS = float(os.getenv("OCR_WARMUP_RETRY_SECONDS", "30"))
+_ocr_executor = ThreadPoolExecutor(max_workers=OCR_POOL_SIZE, thread_name_prefix="ocr")
+
+# 待识别请求队列及后台批处理任务
+_pending: Optional[asyncio.Queue] = None
+_batch_task: Optional[asyncio.Task] = None
+# 进行中的批次任务：保留强引用，避免事件循环只持有弱引用导致任务被回收
+_batch_tasks: Set[asyncio.Task] = set()
+
+
+def _gpu_available() -> bool:
+    """检测Paddle是否可使用GPU"""
+    try:
+        import paddle
+        return bool(paddle.is_compiled_with_cuda()) and paddle.device.cuda.device_count() > 0
+    except Exception:
+        return False
+
+
+def _ocr_engine_options() -> dict:
+    """根据运行环境构造PaddleOCR参数：GPU走TensorRT/fp16（可选），CPU启用MKLDNN多线程"""
+    use_gpu = OCR_DEVICE == "gpu" or (OCR_DEVICE == "auto" and _gpu_available())
+    options = {
+        "use_angle_cls": True,  # 角度分类器
+        "lang": "ch",  # 语言：中文
+        "device": "gpu" if use_gpu else "cpu",
+        "text_recognition_batch_size": 16,
+        "textline_orientation_batch_size": 16,
+        # 按长边限制检测输入尺寸（默认的 "min" 会把短边放大到该值），与 OCR_MAX_SIDE 预缩放一致
+        "text_det_limit_side_len": 960,
+        "text_det_limit_type": "max",
+    }
+    if use_gpu:
+        if OCR_PRECISION == "fp16":
+            options.update(use_tensorrt=True, precision="fp16")
+    else:
+        if OCR_PRECISION == "fp16":
+            logger.warning("⚠️  fp16 仅支持GPU推理，回退到fp32")
+        # 多个引擎并行时平分CPU核数，避免线程超额订阅
+        cpu_threads = max(1, (os.cpu_count() or 1) // OCR_POOL_SIZE)
+        options.update(enable_mkldnn=True, cpu_threads=cpu_threads)
+    return options
+
+
+def _create_ocr_engine():
+    """创建并预热一个PaddleOCR引擎实例"""
+    import numpy as np
+    from paddleocr import PaddleOCR
+
+    options = _ocr_engine_options()
+    logger.info(f"PaddleOCR参数: {options}")
+    engine = PaddleOCR(**options)
+    # 预热：用接近实际尺寸的空白图片跑几次推理，避免首个请求承担初始化开销（TensorRT需多次以完成引擎构建）
+    warmup_image = np.zeros((640, 640, 3), dtype=np.uint8)
+    warmup_runs = 3 if options.get("use_tensorrt") else 2
+    for _ in range(warmup_runs):
+        engine.predict(warmup_image)
+    return engine
+
+
+def init_engine_pool() -> queue.Queue:
+    """初始化OCR引擎池（幂等）"""
+    global _engine_pool
+    if _engine_pool is None:
+        with _engine_pool_lock:
+            if _engine_pool is None:
+                try:
+                    logger.info(f"正在初始化PaddleOCR引擎池 (size={OCR_POOL_SIZE})...")
+                    pool = queue.Queue()
+                    for _ in range(OCR_POOL_SIZE):
+                        pool.put(_create_ocr_engine())
+                    _engine_pool = pool
+                    logger.info("✅ PaddleOCR引擎池初始化成功")
+                except Exception as e:
+                    logger.error(f"❌ PaddleOCR引擎初始化失败: {e}")
+                    raise
+    return _engine_pool
+
+
+def _predict_with_pool(image_input):
+    """从引擎池借出一个引擎执行识别，完成后归还"""
+    pool = init_engine_pool()
+    engine = pool.get()
+    try:
+        return engine.predict(image_input)
+    finally:
+        pool.put(engine)
+
+
+async def run_ocr(image_input):
+    """
+    在专用线程池中执行OCR识别，不阻塞事件循环
+    批处理开启时请求进入队列，由后台任务合批推理后回填结果
+    """
+    loop = asyncio.get_running_loop()
+    if _pending is None:
+        return await loop.run_in_executor(_ocr_executor, _predict_with_pool, image_input)
+
+    future = loop.create_future()
+    await _pending.put((image_input, future))
+    return await future
+
+
+async def _collect_batch(pending: asyncio.Queue) -> list:
+    """收集一批请求：达到批大小或最早的请求等待超过窗口时返回"""
+    loop = asyncio.get_running_loop()
+    items = [await pending.get()]
+    deadline = loop.time() + OCR_BATCH_WAIT_MS / 1000
+    while len(items) < OCR_BATCH_SIZE:
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
         try:
-            from paddleocr import PaddleOCR
-            logger.info("正在初始化PaddleOCR引擎...")
-            _ocr_engine = PaddleOCR(
-                use_angle_cls=True,  # 角度分类器
-                lang='ch'  # 语言：中文
-            )
-            logger.info("✅ PaddleOCR引擎初始化成功")
+            items.append(await asyncio.wait_for(pending.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+    return items
+
+
+async def _run_batch(items: list, slots: asyncio.Semaphore):
+    """对一批图片执行一次推理，并把结果分发给各请求"""
+    loop = asyncio.get_running_loop()
+    try:
+        results = await loop.run_in_executor(
+            _ocr_executor, _predict_with_pool, [image_input for image_input, _ in items]
+        )
+        if len(results) != len(items):
+            raise RuntimeError(f"批量识别结果数量不匹配: {len(results)} != {len(items)}")
+        for (_, future), item_result in zip(items, results):
+            if not future.done():
+                # 与单张识别保持一致的返回结构
+                future.set_result([item_result])
+    except Exception as e:
+        if len(items) > 1:
+            # 整批失败时逐张重试，避免单张坏图拖垮同批其他请求
+            logger.warning(f"⚠️  批量识别失败，逐张重试: {e}")
+            for image_input, future in items:
+                try:
+                    item_result = await loop.run_in_executor(_ocr_executor, _predict_with_pool, image_input)
+                    if not future.done():
+                        future.set_result(item_result)
+                except Exception as item_error:
+                    if not future.done():
+                        future.set_exception(item_error)
+        else:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+    finally:
+        slots.release()
+
+
+async def _batch_worker():
+    """后台批处理循环：所有引擎忙碌时继续积攒请求，形成更大的批次"""
+    slots = asyncio.Semaphore(OCR_POOL_SIZE)
+    while True:
+        await slots.acquire()
+        items = await _collect_batch(_pending)
+        task = asyncio.create_task(_run_batch(items, slots))
+        _batch_tasks.add(task)
+        task.add_done_callback(_batch_tasks.discard)
+
+
+def _extract_texts(result) -> List[str]:
+    """
+    从PaddleOCR返回结果中提取文本行
+    依次尝试: OCRResult.rec_texts → OCRResult.text → OCRResult['rec_texts']
+    → OCRResult.json['res'|顶层]['rec_texts'] → 旧版列表格式
+    """
+    if not result:
+        return []
+    # result通常是一个列表，第一个元素包含所有识别结果
+    ocr_results = result[0] if isinstance(result, list) else result
+    if not ocr_results:
+        return []
+
+    # 快速路径：新版PaddleOCR返回OCRResult对象
+    for attr in ("rec_texts", "text"):
+        texts = getattr(ocr_results, attr, None)
+        if texts is not None:
+            return _normalize_texts(texts)
+
+    # OCRResult为字典子类时，识别文本直接存放在键中
+    try:
+        return _normalize_texts(ocr_results["rec_texts"])
+    except (KeyError, TypeError, IndexError):
+        pass
+
+    # json结构可能包一层 res，也可能直接在顶层
+    try:
+        data = ocr_results.json
+        data = data.get("res", data)
+        return _normalize_texts(data["rec_texts"])
+    except (AttributeError, KeyError, TypeError):
+        pass
+
+    return _extract_legacy_texts(ocr_results)
+
+
+def _normalize_texts(texts) -> List[str]:
+    """将识别文本（单个字符串或文本序列）统一为非空字符串列表"""
+    if isinstance(texts, str):
+        return [texts]
+    return [str(text) for text in texts if text]
+
+
+def _extract_legacy_texts(ocr_results) -> List[str]:
+    """解析旧版PaddleOCR结果格式: [[bbox], (text, confidence)] 或 {'text': ...}"""
+    texts = [
+        str(item[1][0]) if isinstance(item, (list, tuple)) else str(item['text'])
+        for item in ocr_results
+        if (isinstance(item, (list, tuple)) and len(item) >= 2
+            and isinstance(item[1], (list, tuple)) and item[1])
+        or (isinstance(item, dict) and 'text' in item)
+    ]
+    logger.debug(f"旧版格式解析完成，共 {len(texts)} 行")
+    return texts
+
+
+def _decode_image(content: bytes):
+    """将上传的图片字节解码为BGR ndarray（超大图片按长边等比缩小），无法解码时返回None"""
+    import cv2
+    import numpy as np
+
+    image_array = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image_array is None or OCR_MAX_SIDE <= 0:
+        return image_array
+
+    height, width = image_array.shape[:2]
+    scale = OCR_MAX_SIDE / max(height, width)
+    if scale < 1:
+        image_array = cv2.resize(
+            image_array,
+            (max(1, int(width * scale)), max(1, int(height * scale))),
+            interpolation=cv2.INTER_AREA
+        )
+    return image_array
+
+
+async def _warm_up_engines():
+    """后台加载并预热OCR引擎，失败后定期重试（期间 /ready 返回503）"""
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, init_engine_pool)
+            return
         except Exception as e:
-            logger.error(f"❌ PaddleOCR引擎初始化失败: {e}")
-            raise
-    return _ocr_engine
+            # 引擎加载失败不阻止服务启动，首个请求时同样会再次尝试
+            logger.warning(f"⚠️  OCR引擎预加载失败，{OCR_WARMUP_RETRY_SECONDS:g}秒后重试: {e}")
+            await asyncio.sleep(OCR_WARMUP_RETRY_SECONDS)
+
+
+@app.on_event("startup")
+async def preload_engines():
+    """服务启动时在后台预加载并预热OCR引擎，不阻塞启动"""
+    global _warmup_task
+    _warmup_task = asyncio.create_task(_warm_up_engines())
+
+
+@app.on_event("shutdown")
+async def stop_engine_warmup():
+    """停止尚未完成的预热任务"""
+    if _warmup_task is not None and not _warmup_task.done():
+        _warmup_task.cancel()
+
+
+@app.on_event("startup")
+async def start_batch_worker():
+    """启动微批处理后台任务"""
+    global _pending, _batch_task
+    if OCR_BATCH_SIZE > 1:
+        _pending = asyncio.Queue()
+        _batch_task = asyncio.create_task(_batch_worker())
+        logger.info(f"微批处理已启用 (batch={OCR_BATCH_SIZE}, wait={OCR_BATCH_WAIT_MS}ms)")
+
+
+@app.on_event("shutdown")
+async def stop_batch_worker():
+    """停止微批处理后台任务，并等待进行中的批次完成"""
+    if _batch_task is not None:
+        _batch_task.cancel()
+        await asyncio.gather(_batch_task, return_exceptions=True)
+    if _batch_tasks:
+        await asyncio.gather(*_batch_tasks, return_exceptions=True)
 
 
 @app.get("/")
@@ -73,7 +386,8 @@ async def root():
         "endpoints": {
             "recognize": "/api/ocr/recognize",
             "status": "/api/ocr/status",
-            "health": "/health"
+            "health": "/health",
+            "ready": "/ready"
         }
     }
 
@@ -84,6 +398,14 @@ async def health_check():
     return {"status": "healthy", "service": "ocr-recognition"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """就绪检查：引擎池加载并预热完成前返回503，避免负载均衡将请求转发到冷实例"""
+    if _engine_pool is None:
+        return ORJSONResponse({"status": "warming_up", "service": "ocr-recognition"}, status_code=503)
+    return {"status": "ready", "service": "ocr-recognition", "engines": OCR_POOL_SIZE}
+
+
 @app.get("/api/ocr/status")
 async def get_ocr_status():
     """获取OCR服务状态"""
@@ -112,7 +434,7 @@ async def get_ocr_status():
             paddle_version = None
             gpu_available = False
         
-        return JSONResponse(content={
+        return ORJSONResponse({
             "success": True,
             "paddleocr_available": paddleocr_available,
             "paddleocr_version": paddleocr_version,
@@ -124,7 +446,7 @@ async def get_ocr_status():
         
     except Exception as e:
         logger.error(f"状态检查异常: {e}")
-        return JSONResponse(content={
+        return ORJSONResponse({
             "success": False,
             "error": str(e),
             "message": "OCR服务异常"
@@ -137,183 +459,65 @@ async def recognize_image(image: UploadFile = File(...)):
     图片OCR识别接口
     接收图片文件，返回OCR识别结果
     """
-    temp_path = None
     try:
         # 验证文件类型
         if not image.content_type or not image.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="请上传图片文件")
         
-        logger.info(f"📥 接收到图片: {image.filename}, 类型: {image.content_type}")
+        logger.debug(f"📥 接收到图片: {image.filename}, 类型: {image.content_type}")
         
-        # 创建临时文件保存上传的图片
-        with tempfile.NamedTemporaryFile(delete=False, suffix=Path(image.filename).suffix) as temp_file:
-            # 保存上传的图片
-            content = await image.read()
-            temp_file.write(content)
-            temp_file.flush()
-            temp_path = temp_file.name
-            
-            logger.info(f"💾 图片已保存到临时文件: {temp_path}")
-            logger.info(f"📊 文件大小: {len(content)} bytes")
-            
-            # 获取OCR引擎
-            ocr_engine = get_ocr_engine()
-            
-            # 执行OCR识别
-            print("🔍 开始OCR识别...")
-            logger.info("🔍 开始OCR识别...")
-            result = ocr_engine.predict(temp_path)
-            
-            # 详细日志
-            print(f"📋 OCR原始结果类型: {type(result)}")
-            print(f"📋 OCR原始结果: {str(result)[:500]}...")  # 只显示前500字符
-            logger.info(f"📋 OCR原始结果类型: {type(result)}")
-            logger.info(f"📋 OCR原始结果: {str(result)[:500]}...")  # 只显示前500字符
-            
-            if not result:
-                logger.warning("⚠️  OCR识别结果为空")
-                return JSONResponse(content={
-                    "success": True,
-                    "text": "",
-                    "line_count": 0,
-                    "message": "未识别到文字内容"
-                })
-            
-            # 提取识别的文本
-            texts = []
-            
-            # 处理结果 - 新版PaddleOCR返回OCRResult对象
-            try:
-                # result通常是一个列表，第一个元素包含所有识别结果
-                ocr_results = result[0] if isinstance(result, list) and len(result) > 0 else result
-                
-                print(f"📝 ocr_results类型: {type(ocr_results)}")
-                print(f"📝 ocr_results长度: {len(ocr_results) if hasattr(ocr_results, '__len__') else 'N/A'}")
-                logger.info(f"📝 ocr_results类型: {type(ocr_results)}")
-                logger.info(f"📝 ocr_results长度: {len(ocr_results) if hasattr(ocr_results, '__len__') else 'N/A'}")
-                
-                # 检查是否是OCRResult对象
-                if hasattr(ocr_results, '__class__') and 'OCRResult' in str(type(ocr_results)):
-                    print("📦 检测到OCRResult对象")
-                    
-                    # OCRResult对象的文本在 rec_texts 属性中
-                    if hasattr(ocr_results, 'rec_texts'):
-                        rec_texts = ocr_results.rec_texts
-                        print(f"📄 rec_texts类型: {type(rec_texts)}")
-                        print(f"📄 rec_texts内容: {rec_texts}")
-                        if isinstance(rec_texts, list):
-                            for idx, text in enumerate(rec_texts):
-                                if text:
-                                    texts.append(str(text))
-                                    # 获取对应的置信度
-                                    confidence = "N/A"
-                                    if hasattr(ocr_results, 'rec_scores') and idx < len(ocr_results.rec_scores):
-                                        confidence = f"{ocr_results.rec_scores[idx]:.2f}"
-                                    print(f"  ✅ 识别文本[{idx+1}]: {text} (置信度: {confidence})")
-                        elif isinstance(rec_texts, str):
-                            texts.append(rec_texts)
-                            print(f"  ✅ 识别文本: {rec_texts}")
-                    
-                    # 如果没有rec_texts，尝试text属性
-                    elif hasattr(ocr_results, 'text'):
-                        texts_data = ocr_results.text
-                        print(f"📄 text属性类型: {type(texts_data)}")
-                        print(f"📄 text内容: {texts_data}")
-                        if isinstance(texts_data, str):
-                            texts.append(texts_data)
-                        elif isinstance(texts_data, list):
-                            texts.extend([str(t) for t in texts_data if t])
-                    
-                    else:
-                        print("⚠️  未找到rec_texts或text属性，尝试从json中提取")
-                        # 尝试从json属性中提取
-                        if hasattr(ocr_results, 'json'):
-                            json_data = ocr_results.json
-                            print(f"📄 json数据结构: {str(json_data)[:500]}")
-                            
-                            # 从json中提取rec_texts
-                            if isinstance(json_data, dict):
-                                res = json_data.get('res', json_data)
-                                if 'rec_texts' in res:
-                                    rec_texts = res['rec_texts']
-                                    rec_scores = res.get('rec_scores', [])
-                                    print(f"📄 从json提取rec_texts: {rec_texts}")
-                                    for idx, text in enumerate(rec_texts):
-                                        if text:
-                                            texts.append(str(text))
-                                            confidence = rec_scores[idx] if idx < len(rec_scores) else "N/A"
-                                            print(f"  ✅ 识别文本[{idx+1}]: {text} (置信度: {confidence})")
-                        
-                        # 如果还是没有，打印可用属性
-                        if not texts:
-                            if hasattr(ocr_results, '__dict__'):
-                                print(f"可用属性: {list(ocr_results.__dict__.keys())}")
-                            print("⚠️  无法从OCRResult对象中提取文本")
-                
-                elif not ocr_results:
-                    logger.warning("⚠️  解析后的OCR结果为空")
-                    return JSONResponse(content={
-                        "success": True,
-                        "text": "",
-                        "line_count": 0,
-                        "message": "未识别到文字内容"
-                    })
-                
-                else:
-                    # 传统格式处理
-                    for idx, item in enumerate(ocr_results):
-                        try:
-                            logger.info(f"  处理第{idx+1}项，类型: {type(item)}")
-                            
-                            if isinstance(item, (list, tuple)) and len(item) >= 2:
-                                # 格式: [[bbox], (text, confidence)]
-                                text_info = item[1]
-                                if isinstance(text_info, (list, tuple)) and len(text_info) >= 1:
-                                    text = text_info[0]
-                                    confidence = text_info[1] if len(text_info) > 1 else 1.0
-                                    texts.append(str(text))
-                                    print(f"  ✅ 识别文本: {text} (置信度: {confidence:.2f})")
-                                    logger.info(f"  ✅ 识别文本: {text} (置信度: {confidence:.2f})")
-                            elif isinstance(item, dict):
-                                # 如果是字典格式
-                                if 'text' in item:
-                                    texts.append(str(item['text']))
-                                    logger.info(f"  ✅ 识别文本(字典): {item['text']}")
-                        except Exception as e:
-                            logger.warning(f"  ⚠️  解析第{idx+1}项失败: {e}")
-                            continue
+        # 限制上传大小：Content-Length已由中间件在解析前检查；此处表单已解析完毕，
+        # 针对无Content-Length（分块传输）的请求按文件大小及实际读取字节数兜底
+        if image.size is not None and image.size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"图片大小超过限制 ({OCR_MAX_UPLOAD_MB:g}MB)")
+        
+        # 分块读取上传内容，在内存中解码，不再落盘
+        content = bytearray()
+        while chunk := await image.read(UPLOAD_CHUNK_SIZE):
+            content += chunk
+            if len(content) > MAX_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"图片大小超过限制 ({OCR_MAX_UPLOAD_MB:g}MB)")
+        
+        logger.debug(f"📊 文件大小: {len(content)} bytes")
+        
+        image_array = await asyncio.to_thread(_decode_image, content) if content else None
+        if image_array is None:
+            raise HTTPException(status_code=400, detail="无法解析图片内容")
+        
+        # 执行OCR识别
+        logger.debug("🔍 开始OCR识别...")
+        result = await run_ocr(image_array)
+        
+        # 详细日志（仅DEBUG级别，避免在生产环境序列化大对象）
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📋 OCR原始结果类型: {type(result)}")
+            logger.debug(f"📋 OCR原始结果: {str(result)[:500]}...")  # 只显示前500字符
+        
+        # 提取识别的文本
+        try:
+            texts = _extract_texts(result)
+        except Exception as e:
+            logger.error(f"❌ 解析OCR结果异常: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail=f"解析OCR结果失败: {str(e)}")
+        
+        full_text = '\n'.join(texts)
+        logger.info(f"✅ OCR识别完成，共识别 {len(texts)} 行文本")
+        if full_text and logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"📄 识别内容预览: {full_text[:100]}...")
+        
+        # 直接返回ORJSONResponse，跳过FastAPI对结果的jsonable_encoder遍历
+        return ORJSONResponse({
+            "success": True,
+            "text": full_text,
+            "line_count": len(texts),
+            "message": "OCR识别成功" if texts else "未识别到文字内容"
+        })
                 
-            except Exception as e:
-                logger.error(f"❌ 解析OCR结果异常: {e}", exc_info=True)
-                raise HTTPException(status_code=500, detail=f"解析OCR结果失败: {str(e)}")
-            
-            full_text = '\n'.join(texts)
-            print(f"✅ OCR识别完成，共识别 {len(texts)} 行文本")
-            logger.info(f"✅ OCR识别完成，共识别 {len(texts)} 行文本")
-            if full_text:
-                print(f"📄 识别内容预览: {full_text[:100]}...")
-                logger.info(f"📄 识别内容预览: {full_text[:100]}...")
-            
-            return JSONResponse(content={
-                "success": True,
-                "text": full_text,
-                "line_count": len(texts),
-                "message": "OCR识别成功" if texts else "未识别到文字内容"
-            })
-                    
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"❌ OCR识别接口异常: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"OCR识别服务异常: {str(e)}")
-    finally:
-        # 清理临时文件
-        if temp_path:
-            try:
-                os.unlink(temp_path)
-                logger.debug(f"🗑️  临时文件已删除: {temp_path}")
-            except:
-                pass
 
 
 def main():
@@ -347,6 +551,7 @@ def main():
     print("服务地址: http://localhost:8002")
     print("API文档: http://localhost:8002/docs")
     print("健康检查: http://localhost:8002/health")
+    print("就绪检查: http://localhost:8002/ready")
     print("服务状态: http://localhost:8002/api/ocr/status")
     print("\n按 Ctrl+C 停止服务\n")
     
@@ -1,12 +1,12 @@
 """统一完整API - 整合所有功能：工具调用、对话管理、会话历史等"""
 
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, List
 from uuid import uuid4
 import asyncio
-import json
+import orjson
 
 from ..core.mcp_tool_registry import MCPToolRegistry
 from ..core.conversation_manager import ConversationManager, get_conversation_manager as core_get_conversation_manager
@@ -16,12 +16,17 @@ from ..tools.database.mcp_provider import register_database_mcp_tools
 # 创建路由器
 router = APIRouter(tags=["api"])
 
+
+def _sse(event: Dict[str, Any]) -> str:
+    """将事件编码为一条SSE消息（orjson直接输出UTF-8，无需ensure_ascii）"""
+    return f"data: {orjson.dumps(event, option=orjson.OPT_NON_STR_KEYS).decode()}\n\n"
+
 # 全局实例
-_tool_registry = None
-_conversation_manager = None
+_tool_registry: Optional[MCPToolRegistry] = None
+_conversation_manager: Optional[ConversationManager] = None
 
 
-def get_tool_registry():
+def get_tool_registry() -> MCPToolRegistry:
     """获取工具注册中心实例"""
     global _tool_registry
     if _tool_registry is None:
@@ -36,10 +41,13 @@ def get_tool_registry():
         
         print(f"API工具注册系统已初始化，共 {len(_tool_registry.get_all_tools())} 个工具")
     
+    # 延迟注册 @mcp_tool 装饰的函数（列表为空时无开销）
+    _tool_registry.register_pending_tools()
+    
     return _tool_registry
 
 
-def get_conversation_manager():
+def get_conversation_manager() -> ConversationManager:
     """获取对话管理器实例"""
     global _conversation_manager
     if _conversation_manager is None:
@@ -48,6 +56,12 @@ def get_conversation_manager():
     return _conversation_manager
 
 
+def get_manager(request: Request) -> ConversationManager:
+    """FastAPI依赖：返回应用启动时创建的对话管理器（未经lifespan启动时回退为惰性创建）"""
+    manager = getattr(request.app.state, "conversation_manager", None)
+    return manager if manager is not None else get_conversation_manager()
+
+
 # ==================== 请求/响应模型 ====================
 
 class ToolExecuteRequest(BaseModel):
@@ -156,13 +170,13 @@ async def execute_tool(request: ToolExecuteRequest):
         # 如果结果是字符串（JSON格式），尝试解析
         if isinstance(result, str):
             try:
-                parsed_result = json.loads(result)
+                parsed_result = orjson.loads(result)
                 return {
                     "success": True,
                     "tool_name": request.tool_name,
                     "result": parsed_result
                 }
-            except json.JSONDecodeError:
+            except orjson.JSONDecodeError:
                 return {
                     "success": True,
                     "tool_name": request.tool_name,
@@ -189,15 +203,13 @@ async def execute_tool(request: ToolExecuteRequest):
 # ==================== 对话相关API ====================
 
 @router.post("/conversation/plan")
-async def plan_and_execute(request: ConversationRequest):
+async def plan_and_execute(request: ConversationRequest, conversation_manager: ConversationManager = Depends(get_manager)):
     """规划并执行任务（ReAct架构）"""
     
     # 生成线程ID
     thread_id = request.thread_id or str(uuid4())
     
     try:
-        conversation_manager = get_conversation_manager()
-        
         # 执行对话
         result = await conversation_manager.run_conversation(
             user_input=request.question,
@@ -234,7 +246,7 @@ async def plan_and_execute(request: ConversationRequest):
 
 
 @router.post("/conversation/plan/stream")
-async def plan_stream(request: ConversationRequest):
+async def plan_stream(request: ConversationRequest, conversation_manager: ConversationManager = Depends(get_manager)):
     """流式执行计划，支持Server-Sent Events"""
     
     # 生成线程ID
@@ -251,8 +263,6 @@ async def plan_stream(request: ConversationRequest):
         }
         
         try:
-            conversation_manager = get_conversation_manager()
-            
             # 检测用户是否要继续对话（输入"继续"、"continue"等）
             user_input_lower = request.question.strip().lower()
             is_continue = (user_input_lower in ["继续", "continue", "继续执行", "继续任务"] or 
@@ -261,7 +271,7 @@ async def plan_stream(request: ConversationRequest):
             # 如果用户要继续，确保有thread_id
             if is_continue and not thread_id:
                 # 尝试从最近的对话中获取thread_id（这里简化处理，实际可能需要更复杂的逻辑）
-                yield f"data: {json.dumps({'type': 'error', 'data': {'error': '无法继续：未指定thread_id'}}, ensure_ascii=False)}\n\n"
+                yield _sse({'type': 'error', 'data': {'error': '无法继续：未指定thread_id'}})
                 return
             
             # ========== 关键修复：同一会话中自动恢复上下文 ==========
@@ -269,15 +279,15 @@ async def plan_stream(request: ConversationRequest):
             # 如果历史状态存在，说明这是同一会话的后续问题，应该恢复上下文
             should_continue = is_continue or request.continue_conversation
             if thread_id and not should_continue:
-                # 检查是否存在历史状态
-                existing_state = conversation_manager.load_conversation(thread_id)
-                if existing_state and len(existing_state.messages) > 0:
+                # 检查是否存在历史状态（只在SQL中统计条数，不加载完整状态）
+                counts = await asyncio.to_thread(conversation_manager.get_conversation_counts, thread_id)
+                if counts and counts[0] > 0:
                     # 存在历史状态，自动恢复上下文
                     should_continue = True
-                    print(f"[API] 检测到历史状态，自动恢复上下文。已有 {len(existing_state.messages)} 条消息，{len(existing_state.steps)} 个步骤")
+                    print(f"[API] 检测到历史状态，自动恢复上下文。已有 {counts[0]} 条消息，{counts[1]} 个步骤")
             
             # 发送初始化信息
-            yield f"data: {json.dumps({'type': 'init', 'data': {'thread_id': thread_id, 'question': request.question}}, ensure_ascii=False)}\n\n"
+            yield _sse({'type': 'init', 'data': {'thread_id': thread_id, 'question': request.question}})
             
             # 添加用户消息
             collected_state["messages"].append({
@@ -331,7 +341,7 @@ async def plan_stream(request: ConversationRequest):
                         final_state = step_data["data"]["state"]
                 
                 # 发送步骤数据
-                yield f"data: {json.dumps(step_data, ensure_ascii=False)}\n\n"
+                yield _sse(step_data)
                 
                 # 添加小延迟以确保前端能正确接收
                 await asyncio.sleep(0.1)
@@ -365,23 +375,24 @@ async def plan_stream(request: ConversationRequest):
                 )
                 print(f"[API] 警告：未收到coordinator的完整状态，使用默认值")
             
-            # 保存到数据库
+            # 保存到数据库（已有会话沿用原创建时间、工具类别和标签）
+            existing_metadata = await asyncio.to_thread(conversation_manager.get_conversation_metadata, thread_id)
             metadata = ConversationMetadata(
                 thread_id=thread_id,
                 user_id="default",
                 title=request.question[:50],  # 使用问题的前50个字符作为标题
-                created_at=datetime.now(),
+                created_at=existing_metadata.created_at if existing_metadata else datetime.now(),
                 updated_at=datetime.now(),
-                tool_categories=[],
-                tags=[]
+                tool_categories=list(existing_metadata.tool_categories) if existing_metadata else [],
+                tags=list(existing_metadata.tags) if existing_metadata else []
             )
             
-            conversation_manager.save_conversation(metadata, state)
+            await asyncio.to_thread(conversation_manager.save_conversation, metadata, state)
             print(f"✅ [API] 对话已保存到数据库: {thread_id}")
             
             # 发送完成信号（包含最终答案）
-            yield f"data: {json.dumps({{'type': 'final', 'data': {{'content': collected_state['answer'], 'thread_id': thread_id}}}}, ensure_ascii=False)}\n\n"
-            yield f"data: {json.dumps({'type': 'complete', 'data': {'thread_id': thread_id}}, ensure_ascii=False)}\n\n"
+            yield _sse({'type': 'final', 'data': {'content': collected_state['answer'], 'thread_id': thread_id}})
+            yield _sse({'type': 'complete', 'data': {'thread_id': thread_id}})
             
         except Exception as e:
             # 发送错误信息
@@ -392,7 +403,7 @@ async def plan_stream(request: ConversationRequest):
                     "error": str(e)
                 }
             }
-            yield f"data: {json.dumps(error_data, ensure_ascii=False)}\n\n"
+            yield _sse(error_data)
     
     return StreamingResponse(
         generate_stream(),
@@ -400,9 +411,7 @@ async def plan_stream(request: ConversationRequest):
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-            "Content-Type": "text/event-stream",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "*"
+            "Content-Type": "text/event-stream"
         }
     )
 
@@ -410,7 +419,7 @@ async def plan_stream(request: ConversationRequest):
 # ==================== 测试API（简化对话，不使用ReAct）====================
 
 @router.post("/conversation/test/simple")
-async def simple_test_conversation(request: ConversationRequest):
+async def simple_test_conversation(request: ConversationRequest, conversation_manager: ConversationManager = Depends(get_manager)):
     """
     简化测试接口 - 不使用ReAct，直接返回固定回答
     用于测试会话管理功能，排除ReAct引擎的干扰
@@ -426,8 +435,6 @@ async def simple_test_conversation(request: ConversationRequest):
     fixed_answer = f"这是测试回答（简化模式）。您的问题是：{request.question}"
     
     try:
-        conversation_manager = get_conversation_manager()
-        
         # 构建简单的状态对象
         state = AgentState(
             question=request.question,
@@ -459,7 +466,7 @@ async def simple_test_conversation(request: ConversationRequest):
             tags=["simple-test"]
         )
         
-        conversation_manager.save_conversation(metadata, state)
+        await asyncio.to_thread(conversation_manager.save_conversation, metadata, state)
         print(f"✅ [TEST API] 测试对话已保存: {thread_id}")
         
         return {
@@ -475,7 +482,7 @@ async def simple_test_conversation(request: ConversationRequest):
 
 
 @router.post("/conversation/test/stream")
-async def simple_test_stream(request: ConversationRequest):
+async def simple_test_stream(request: ConversationRequest, conversation_manager: ConversationManager = Depends(get_manager)):
     """
     简化测试接口（流式）- 不使用ReAct，直接返回固定回答
     用于测试会话管理功能，排除ReAct引擎的干扰
@@ -493,22 +500,20 @@ async def simple_test_stream(request: ConversationRequest):
             fixed_answer = f"这是测试回答（简化流式模式）。您的问题是：{request.question}"
             
             # 发送初始化信息
-            yield f"data: {json.dumps({'type': 'init', 'data': {'thread_id': thread_id, 'question': request.question}}, ensure_ascii=False)}\n\n"
+            yield _sse({'type': 'init', 'data': {'thread_id': thread_id, 'question': request.question}})
             await asyncio.sleep(0.1)
             
             # 发送思考步骤（模拟）
-            yield f"data: {json.dumps({'type': 'thinking', 'data': {'step': 1, 'message': '正在处理（测试模式）...'}}, ensure_ascii=False)}\n\n"
+            yield _sse({'type': 'thinking', 'data': {'step': 1, 'message': '正在处理（测试模式）...'}})
             await asyncio.sleep(0.2)
             
             # 发送完成信号
-            yield f"data: {json.dumps({'type': 'finish', 'data': {'answer': fixed_answer, 'total_steps': 1}}, ensure_ascii=False)}\n\n"
+            yield _sse({'type': 'finish', 'data': {'answer': fixed_answer, 'total_steps': 1}})
             await asyncio.sleep(0.1)
             
             # ========== 保存到数据库 ==========
-            conversation_manager = get_conversation_manager()
-            
             # 检查是否已有会话，如果有就追加消息
-            existing_state = conversation_manager.load_conversation(thread_id)
+            existing_state = await asyncio.to_thread(conversation_manager.load_conversation, thread_id)
             
             if existing_state:
                 # 追加新消息到现有会话
@@ -530,7 +535,7 @@ async def simple_test_stream(request: ConversationRequest):
                     tags=["simple-test-stream"]
                 )
                 
-                conversation_manager.save_conversation(metadata, existing_state)
+                await asyncio.to_thread(conversation_manager.save_conversation, metadata, existing_state)
                 print(f"✅ [TEST STREAM API] 测试对话已更新（追加消息）: {thread_id}")
             else:
                 # 创建新会话
@@ -563,18 +568,18 @@ async def simple_test_stream(request: ConversationRequest):
                     tags=["simple-test-stream"]
                 )
                 
-                conversation_manager.save_conversation(metadata, state)
+                await asyncio.to_thread(conversation_manager.save_conversation, metadata, state)
                 print(f"✅ [TEST STREAM API] 测试对话已创建: {thread_id}")
             
             # 发送最终答案
-            yield f"data: {json.dumps({'type': 'final', 'data': {'content': fixed_answer, 'thread_id': thread_id}}, ensure_ascii=False)}\n\n"
+            yield _sse({'type': 'final', 'data': {'content': fixed_answer, 'thread_id': thread_id}})
             
             # 发送完成信号
-            yield f"data: {json.dumps({'type': 'complete', 'data': {'thread_id': thread_id}}, ensure_ascii=False)}\n\n"
+            yield _sse({'type': 'complete', 'data': {'thread_id': thread_id}})
             
         except Exception as e:
             print(f"❌ [TEST STREAM API] 错误: {str(e)}")
-            yield f"data: {json.dumps({'type': 'error', 'data': {'error': str(e), 'thread_id': thread_id}}, ensure_ascii=False)}\n\n"
+            yield _sse({'type': 'error', 'data': {'error': str(e), 'thread_id': thread_id}})
     
     return StreamingResponse(
         generate_simple_stream(),
@@ -582,68 +587,172 @@ async def simple_test_stream(request: ConversationRequest):
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
-            "Content-Type": "text/event-stream",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Headers": "*"
+            "Content-Type": "text/event-stream"
         }
     )
 
 
 # ==================== 会话历史API ====================
 
-@router.get("/conversation/history")
+@router.get("/conversation/history", response_model=None)
 async def list_conversations(
     user_id: str = "default",
     tool_category: Optional[str] = None,
-    limit: int = 100
+    limit: int = 100,
+    offset: int = 0,
+    search: Optional[str] = None,
+    conversation_manager: ConversationManager = Depends(get_manager)
 ):
-    """列出对话历史"""
+    """列出对话历史（支持标题搜索和分页）"""
     try:
-        conversation_manager = get_conversation_manager()
-        conversations = conversation_manager.list_conversations(
-            user_id=user_id,
-            tool_category=tool_category,
-            limit=limit
+        # SQLite查询在线程池中执行，不阻塞事件循环；WAL模式下列表和计数可并发读取
+        conversations, total = await asyncio.gather(
+            asyncio.to_thread(
+                conversation_manager.list_conversations,
+                user_id=user_id,
+                tool_category=tool_category,
+                limit=limit,
+                offset=offset,
+                search=search
+            ),
+            asyncio.to_thread(
+                conversation_manager.count_conversations,
+                user_id=user_id,
+                tool_category=tool_category,
+                search=search
+            )
         )
         
-        return {
+        return ORJSONResponse({
             "ok": True,
             "conversations": conversations,
-            "total": len(conversations)
-        }
+            "total": total,
+            "limit": limit,
+            "offset": offset
+        })
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取对话历史失败: {str(e)}")
 
 
-@router.get("/conversation/{thread_id}")
-async def get_conversation(thread_id: str):
+@router.get("/conversation/stats", response_model=None)
+async def get_conversation_stats(user_id: str = "default", top: Optional[int] = None,
+                                 conversation_manager: ConversationManager = Depends(get_manager)):
+    """获取对话统计信息"""
+    try:
+        return ORJSONResponse({
+            "ok": True,
+            "stats": await asyncio.to_thread(conversation_manager.get_stats, user_id=user_id, top_n=top)
+        })
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取对话统计失败: {str(e)}")
+
+
+async def _build_conversation_detail(conversation_manager: ConversationManager, thread_id: str) -> Dict[str, Any]:
+    """构建对话详情（详情和导出接口共用），对话不存在时抛出404"""
+    # 只读路径：直接使用缓存的状态字典，不再构造AgentState后再转回字典
+    state_data = await asyncio.to_thread(conversation_manager.get_conversation_data, thread_id)
+    
+    if state_data is None:
+        raise HTTPException(status_code=404, detail=f"对话 {thread_id} 不存在")
+    
+    return {
+        "ok": True,
+        "thread_id": thread_id,
+        "state": state_data
+    }
+
+
+_EXPORT_ROLE_NAMES: Dict[str, str] = {"user": "用户", "assistant": "助手", "system": "系统"}
+
+
+def _render_conversation_markdown(detail: Dict[str, Any]) -> str:
+    """将对话详情渲染为Markdown（分段收集后一次join，避免字符串反复拼接）"""
+    state = detail["state"]
+    parts: List[str] = [f"# {state.get('question', '')}\n\n", f"- 会话ID: `{detail['thread_id']}`\n\n"]
+    for message in state.get("messages", []):
+        role = _EXPORT_ROLE_NAMES.get(message.get("role"), message.get("role", ""))
+        parts.append(f"## {role}\n\n")
+        content = message.get("content", "")
+        # 工具/助手消息可能保存结构化内容（列表/字典），序列化为JSON文本
+        if not isinstance(content, str):
+            content = orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS).decode()
+        parts.append(content)
+        parts.append("\n\n")
+    return "".join(parts)
+
+
+@router.get("/conversation/{thread_id}", response_model=None)
+async def get_conversation(thread_id: str, conversation_manager: ConversationManager = Depends(get_manager)):
     """获取指定对话的详情"""
     try:
-        conversation_manager = get_conversation_manager()
-        state = conversation_manager.load_conversation(thread_id)
+        # 直接返回ORJSONResponse，跳过FastAPI对整个状态字典的jsonable_encoder递归遍历
+        return ORJSONResponse(await _build_conversation_detail(conversation_manager, thread_id))
         
-        if state is None:
-            raise HTTPException(status_code=404, detail=f"对话 {thread_id} 不存在")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"获取对话失败: {str(e)}")
+
+
+async def _iter_ndjson_messages(conversation_manager: ConversationManager, thread_id: str,
+                                chunk_size: int = 200):
+    """按批异步产出NDJSON行：每批消息在线程中用独立连接读取，按消息下标分页"""
+    after_key = -1
+    while True:
+        rows = await asyncio.to_thread(conversation_manager.get_message_chunk, thread_id, after_key, chunk_size)
+        if not rows:
+            return
+        yield "".join(message + "\n" for _, message in rows)
+        after_key = rows[-1][0]
+
+
+@router.get("/conversation/{thread_id}/export")
+async def export_conversation(thread_id: str, format: str = "json", conversation_manager: ConversationManager = Depends(get_manager)):
+    """导出对话（json、markdown 或 ndjson）
+    
+    ndjson 按消息逐行流式输出，内存占用与对话长度无关，适合长对话。
+    """
+    if format not in ("json", "markdown", "ndjson"):
+        raise HTTPException(status_code=400, detail=f"不支持的导出格式: {format}")
+    
+    try:
+        if format == "ndjson":
+            counts = await asyncio.to_thread(conversation_manager.get_conversation_counts, thread_id)
+            if counts is None:
+                raise HTTPException(status_code=404, detail=f"对话 {thread_id} 不存在")
+            return StreamingResponse(
+                _iter_ndjson_messages(conversation_manager, thread_id),
+                media_type="application/x-ndjson",
+                headers={"Content-Disposition": f'attachment; filename="{thread_id}.ndjson"'}
+            )
         
-        return {
-            "ok": True,
-            "thread_id": thread_id,
-            "state": state.dict() if hasattr(state, 'dict') else state.__dict__
-        }
+        detail = await _build_conversation_detail(conversation_manager, thread_id)
+        
+        if format == "markdown":
+            return Response(
+                content=_render_conversation_markdown(detail),
+                media_type="text/markdown; charset=utf-8",
+                headers={"Content-Disposition": f'attachment; filename="{thread_id}.md"'}
+            )
+        return Response(
+            content=orjson.dumps(detail, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_INDENT_2),
+            media_type="application/json",
+            headers={"Content-Disposition": f'attachment; filename="{thread_id}.json"'}
+        )
         
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"获取对话失败: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"导出对话失败: {str(e)}")
 
 
 @router.delete("/conversation/{thread_id}")
-async def delete_conversation(thread_id: str):
+async def delete_conversation(thread_id: str, conversation_manager: ConversationManager = Depends(get_manager)):
     """删除指定对话"""
     try:
-        conversation_manager = get_conversation_manager()
-        conversation_manager.delete_conversation(thread_id)
+        await asyncio.to_thread(conversation_manager.delete_conversation, thread_id)
         
         return {
             "ok": True,
@@ -668,7 +777,7 @@ async def list_database_tables():
     try:
         result = tool.handler()
         if isinstance(result, str):
-            return json.loads(result)
+            return orjson.loads(result)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -686,7 +795,7 @@ async def describe_database_table(table_name: str):
     try:
         result = tool.handler(table=table_name)
         if isinstance(result, str):
-            return json.loads(result)
+            return orjson.loads(result)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -704,7 +813,7 @@ async def execute_database_query(sql: str, limit: int = 100):
     try:
         result = tool.handler(sql=sql, limit=limit)
         if isinstance(result, str):
-            return json.loads(result)
+            return orjson.loads(result)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -722,7 +831,7 @@ async def sample_database_table(table_name: str, limit: int = 5, columns: Option
     try:
         result = tool.handler(table=table_name, limit=limit, columns=columns)
         if isinstance(result, str):
-            return json.loads(result)
+            return orjson.loads(result)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -3,7 +3,9 @@
 from .schemas import (
     ActionName, DecideOut, Step, AgentState,
     StepType, FlexibleDecideOut, FlexibleStep, FlexibleAgentState,
-    validate_decide, validate_flexible_decide, get_flexible_system_prompt
+    validate_decide, validate_flexible_decide, get_flexible_system_prompt,
+    FLEXIBLE_DECIDE_JSON_SCHEMA, ActionArgs, ListTablesArgs, DescribeTableArgs,
+    SampleRowsArgs, RunSqlArgs
 )
 from .guard import ensure_safe_sql
 
@@ -19,5 +21,11 @@ __all__ = [
     "validate_decide",
     "validate_flexible_decide",
     "get_flexible_system_prompt",
+    "FLEXIBLE_DECIDE_JSON_SCHEMA",
+    "ActionArgs",
+    "ListTablesArgs",
+    "DescribeTableArgs",
+    "SampleRowsArgs",
+    "RunSqlArgs",
     "ensure_safe_sql"
 ]
\ No newline at end of file
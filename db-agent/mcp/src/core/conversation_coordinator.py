@@ -1,6 +1,10 @@
 """对话协调器 - 负责协调ReAct引擎和会话管理"""
 
+import hashlib
 import json
+import os
+import orjson
+from operator import attrgetter
 from typing import Dict, Any, List, Optional, AsyncGenerator
 from datetime import datetime
 from uuid import uuid4
@@ -10,6 +14,13 @@ from .react_engine import ReActEngine
 from .mcp_tool_registry import MCPToolRegistry
 
 
+# 历史摘要格式版本，修改摘要内容格式时递增以使旧缓存失效
+COMPRESS_PROMPT_VERSION = "1"
+
+# 遍历步骤时一次取出常用字段（C实现，避免逐个属性查找）
+_STEP_FIELDS = attrgetter("step_type", "action", "args", "observation")
+
+
 class ConversationCoordinator:
     """对话协调器 - 协调ReAct推理和会话状态管理"""
     
@@ -19,8 +30,10 @@ class ConversationCoordinator:
         self.conversation_manager = conversation_manager  # 用于加载历史状态
         
         # 消息压缩配置（可通过环境变量调整）
-        import os
         self.message_compress_recent_window = int(os.getenv("MESSAGE_COMPRESS_RECENT_WINDOW", "10"))  # 保留最近N条完整消息
+        self.message_compress_threshold = int(os.getenv(
+            "MESSAGE_COMPRESS_THRESHOLD", str(self.message_compress_recent_window * 2)
+        ))  # 摘要之后累积超过N条消息才重新压缩
         self.message_compress_max_length = int(os.getenv("MESSAGE_COMPRESS_MAX_LENGTH", "5000"))  # 压缩后最大字符数
     
     async def run_conversation_stream(self, user_input: str, session_id: str, max_steps: int = 12, 
@@ -102,6 +115,10 @@ class ConversationCoordinator:
                 {"role": "user", "content": user_input}
             ]
         
+        # 状态直接持有同一个消息列表：之后只追加新的消息对象、从不修改已有消息，
+        # 既避免每一步整表拷贝，也让LLM供应商的前缀缓存保持命中
+        state.messages = messages
+        
         # 计算已执行步数
         # 重要：区分"继续之前的任务"和"在同一会话中问新问题"
         # 只有当用户明确说"继续"时，才使用历史步数；否则重置为0
@@ -141,7 +158,9 @@ class ConversationCoordinator:
                 )
                 if len(messages) != len(compressed_messages):
                     print(f"[Conversation Coordinator] 消息压缩: {len(messages)} -> {len(compressed_messages)} 条（完整消息已保存用于展示）")
-                react_result = await self.react_engine.execute_react_step(compressed_messages)
+                react_result = await self.react_engine.execute_react_step(
+                    compressed_messages, use_cache=state.use_action_cache
+                )
                 print(f"[Conversation Coordinator] ReAct引擎返回结果类型: {react_result.get('type', 'unknown')}")
                 
                 # 处理不同类型的步骤结果
@@ -157,12 +176,15 @@ class ConversationCoordinator:
                     
                     # 添加助手消息到对话历史
                     messages.append({"role": "assistant", "content": f"思考: {react_result['data']['thought']}"})
-                    # 更新状态的消息列表
-                    state.messages = messages.copy()
                 
                 elif react_result["type"] == "action":
+                    # 工具结果只解析一次，步骤记录、观察消息共用解析结果
+                    tool_result = react_result["data"]["result"]
+                    observation, is_json_text = self._parse_tool_result(tool_result)
+                    action_data = {**react_result["data"], "result": observation}
+                    
                     # 记录行动步骤
-                    action_step = self._create_step(len(state.steps), "action", react_result["data"])
+                    action_step = self._create_step(len(state.steps), "action", action_data)
                     state.steps.append(action_step)
                     
                     yield {"type": "step", "data": {
@@ -176,7 +198,7 @@ class ConversationCoordinator:
                     # 记录观察步骤
                     observation_step = self._create_step(len(state.steps), "observation", {
                         "tool_name": react_result["data"]["tool_name"],
-                        "result": react_result["data"]["result"]
+                        "result": observation
                     })
                     state.steps.append(observation_step)
                     
@@ -191,10 +213,9 @@ class ConversationCoordinator:
                     messages.append({"role": "assistant", "content": f"行动: {react_result['data']['thought']}"})
                     messages.append(self.react_engine.build_observation_message(
                         react_result["data"]["tool_name"], 
-                        react_result["data"]["result"]
+                        tool_result,
+                        validated_json=is_json_text
                     ))
-                    # 更新状态的消息列表
-                    state.messages = messages.copy()
                 
                 elif react_result["type"] == "error":
                     error_step = self._create_step(len(state.steps), "error", react_result["data"])
@@ -210,16 +231,15 @@ class ConversationCoordinator:
                     error_type = react_result["data"].get("error_type", "unknown")
                     
                     if error_type == "json_parse_error":
-                        # JSON解析错误：将错误信息和原始响应添加到对话历史，让LLM重新生成
-                        # 检查是否连续多次JSON解析错误，避免无限重试
-                        json_error_count = sum(1 for step in state.steps if step.step_type == "error" and "JSON解析" in str(step.observation))
+                        # JSON解析错误：把错误信息和原始响应片段回填给LLM，让其修正后重新生成；
+                        # 连续多次失败则结束对话，避免空转
+                        json_error_count = sum(1 for step in state.steps if step.step_type == "error" and "JSON解析" in step.content)
                         if json_error_count >= 3:
                             # 连续3次JSON解析错误，直接结束对话并返回错误
                             state.done = True
                             error_msg = "抱歉，系统在处理您的请求时遇到了格式问题。请稍后重试或尝试重新表述您的问题。"
                             state.answer = {"ok": False, "data": error_msg}
                             messages.append({"role": "assistant", "content": error_msg})
-                            state.messages = messages.copy()
                             yield {"type": "finish", "data": {
                                 "answer": error_msg,
                                 "total_steps": len(state.steps),
@@ -229,21 +249,11 @@ class ConversationCoordinator:
                             break
                         
                         raw_response = react_result["data"].get("raw_response", "")
-                        error_message = f"""格式错误：你的响应不是有效的JSON格式。系统无法解析你的响应。
-
-请严格按照系统提示词要求的JSON格式回复。你的响应必须是纯JSON对象，不能包含其他文本。
-
-错误详情: {react_result['data']['error']}
-
-你刚才的响应（前500字符）:
-{raw_response[:500]}
-
-请重新生成符合以下格式的JSON响应（注意：answer字段要简洁，不要复制工具原始数据）：
-- 推理步骤: {{"thought": "...", "step_type": "reasoning", "analysis": "...", "plan": [...]}}
-- 行动步骤: {{"thought": "...", "step_type": "action", "action": "...", "args": {{...}}}}
-- 完成步骤: {{"thought": "...", "step_type": "finish", "answer": "简洁的用户友好回答", "rationale": "..."}}"""
-                        
-                        messages.append({"role": "user", "content": error_message})
+                        messages.append({"role": "user", "content": (
+                            f"格式错误：系统无法解析你的响应，请只输出符合系统提示词格式的纯JSON对象。\n"
+                            f"错误详情: {react_result['data']['error']}\n"
+                            f"你刚才的响应（前300字符）:\n{raw_response[:300]}"
+                        )})
                         print(f"[Conversation Coordinator] JSON解析错误（第{json_error_count + 1}次），已添加错误信息到对话历史，将在下一轮重试")
                     else:
                         # 工具执行错误等其他错误：正常处理
@@ -255,7 +265,6 @@ class ConversationCoordinator:
                     state.answer = {"ok": True, "data": react_result["data"]["answer"]}
                     # 添加最终答案到消息历史
                     messages.append({"role": "assistant", "content": react_result["data"]["answer"]})
-                    state.messages = messages.copy()
                     
                     # 更新状态信息：从工具执行结果中提取表信息
                     self._update_state_from_steps(state)
@@ -288,7 +297,6 @@ class ConversationCoordinator:
             # 添加总结到消息历史
             pause_message = summary + "\n\n已达到最大步数限制。当前进度总结如上，您可以回复'继续'来继续执行，或提供新的指令。"
             messages.append({"role": "assistant", "content": pause_message})
-            state.messages = messages.copy()
             
             # 返回暂停状态，询问用户是否继续（包含完整状态）
             yield {"type": "pause", "data": {
@@ -388,18 +396,18 @@ class ConversationCoordinator:
     
     def _update_state_from_steps(self, state: AgentState):
         """从执行步骤中更新状态信息（known_tables, known_schemas等）"""
-        # 从步骤中提取表信息
+        # 从步骤中提取表信息（每轮结束都会遍历全部步骤，字段一次性取出）
         for step in state.steps:
-            if step.step_type == "action":
-                tool_name = step.action
+            step_type, tool_name, args, raw_observation = _STEP_FIELDS(step)
+            if step_type == "action":
                 # 处理observation可能是字符串的情况
-                if isinstance(step.observation, str):
+                if isinstance(raw_observation, str):
                     try:
-                        observation = json.loads(step.observation)
-                    except:
+                        observation = orjson.loads(raw_observation)
+                    except orjson.JSONDecodeError:
                         observation = {}
                 else:
-                    observation = step.observation if isinstance(step.observation, dict) else {}
+                    observation = raw_observation if isinstance(raw_observation, dict) else {}
                 
                 # 处理list_tables结果
                 if tool_name == "list_tables":
@@ -431,7 +439,7 @@ class ConversationCoordinator:
                         # 尝试从不同格式中提取表名和结构
                         table_name = (observation.get("table_name") or 
                                      observation.get("data", {}).get("table_name") or
-                                     step.args.get("table"))
+                                     args.get("table"))
                         if table_name:
                             if table_name not in state.known_tables:
                                 state.known_tables.append(table_name)
@@ -446,9 +454,24 @@ class ConversationCoordinator:
                                     "table_name": table_name
                                 }
                 
+                # 处理describe_tables结果（批量表结构）
+                elif tool_name == "describe_tables":
+                    if isinstance(observation, dict):
+                        for table_data in observation.get("data", {}).get("tables", []):
+                            table_name = table_data.get("table")
+                            if not table_name:
+                                continue
+                            if table_name not in state.known_tables:
+                                state.known_tables.append(table_name)
+                            if table_data.get("columns"):
+                                state.known_schemas[table_name] = {
+                                    "columns": table_data["columns"],
+                                    "table_name": table_name
+                                }
+                
                 # 处理sample_rows结果
                 elif tool_name == "sample_rows":
-                    table_name = step.args.get("table") or step.args.get("table_name")
+                    table_name = args.get("table") or args.get("table_name")
                     if table_name:
                         if table_name not in state.known_tables:
                             state.known_tables.append(table_name)
@@ -458,18 +481,15 @@ class ConversationCoordinator:
                 
                 # 处理run_sql结果 - 记录SQL历史
                 elif tool_name == "run_sql":
-                    sql = step.args.get("sql") or ""
+                    sql = args.get("sql") or ""
+                    # 每轮结束都会重新遍历全部步骤，按SQL哈希去重避免重复追加
                     if sql:
-                        state.sql_history.append({
-                            "sql": sql,
-                            "result": observation,
-                            "timestamp": step.timestamp
-                        })
+                        state.record_sql(sql, observation, step.timestamp)
             
             # 处理错误
-            elif step.step_type == "error":
+            elif step_type == "error":
                 error_info = step.content if isinstance(step.content, dict) else {"error": str(step.content)}
-                state.error_history.append(error_info)
+                state.record_error(error_info)
                 state.last_error = error_info.get("error", str(error_info))
         
         print(f"[Conversation Coordinator] 状态更新完成: 已知表 {len(state.known_tables)} 个, 已知结构 {len(state.known_schemas)} 个")
@@ -487,75 +507,31 @@ class ConversationCoordinator:
         Returns:
             压缩后的消息列表
         """
-        if len(full_messages) <= recent_window:
-            # 消息数量不多，直接返回
-            return full_messages
-        
-        # 分离系统消息和用户/助手消息
-        system_msg = full_messages[0] if full_messages and full_messages[0].get("role") == "system" else None
-        conversation_messages = full_messages[1:] if system_msg else full_messages
-        
-        # 如果消息太多，压缩较早的消息
-        if len(conversation_messages) > recent_window:
-            # 保留最近的消息
-            recent_messages = conversation_messages[-recent_window:]
-            older_messages = conversation_messages[:-recent_window]
-            
-            # 检查是否可以使用缓存的压缩摘要
-            config_hash = self._get_compress_config_hash(recent_window, max_compressed_length)
-            can_use_cache = (
-                state.compressed_summary is not None and
-                state.compressed_message_count == len(older_messages) and
-                state.compressed_config_hash == config_hash
-            )
-            
-            if can_use_cache:
-                # 使用缓存的压缩摘要
-                compressed_summary = state.compressed_summary
-                print(f"[Conversation Coordinator] 使用缓存的压缩摘要（{len(older_messages)}条消息）")
-            else:
-                # 重新计算压缩摘要
-                compressed_summary = self._summarize_older_messages(older_messages, state)
-                # 更新缓存
-                state.compressed_summary = compressed_summary
-                state.compressed_message_count = len(older_messages)
-                state.compressed_config_hash = config_hash
-                print(f"[Conversation Coordinator] 重新计算压缩摘要（{len(older_messages)}条消息）并缓存")
-            
-            # 构建压缩后的消息列表
-            compressed = []
-            if system_msg:
-                compressed.append(system_msg)
-            
-            # 如果有摘要，添加摘要消息
-            if compressed_summary:
-                compressed.append({
-                    "role": "system",
-                    "content": f"## 历史对话摘要（已压缩{len(older_messages)}条消息）\n\n{compressed_summary}"
-                })
-            
-            # 添加最近的消息
-            compressed.extend(recent_messages)
-            
-            # 检查总长度，如果还是太长，进一步压缩observation消息
-            total_length = sum(len(str(msg.get("content", ""))) for msg in compressed)
-            if total_length > max_compressed_length:
-                compressed = self._compress_observation_messages(compressed, max_compressed_length)
-            
-            return compressed
+        config_hash = self._get_compress_config_hash(recent_window, max_compressed_length)
+        cached_count = state.compressed_message_count
+        compressed = state.effective_messages(
+            full_messages,
+            compressor=lambda older: self._summarize_older_messages(older, state),
+            t_hist=self.message_compress_threshold,
+            keep_recent=recent_window,
+            config_hash=config_hash
+        )
+        if state.compressed_message_count != cached_count:
+            print(f"[Conversation Coordinator] 重新计算压缩摘要（{state.compressed_message_count}条消息）并缓存")
         
-        # 如果消息不多，但总长度超限，压缩observation消息
-        total_length = sum(len(str(msg.get("content", ""))) for msg in full_messages)
+        # 检查总长度，如果还是太长，进一步压缩observation消息
+        total_length = sum(len(str(msg.get("content", ""))) for msg in compressed)
         if total_length > max_compressed_length:
-            return self._compress_observation_messages(full_messages, max_compressed_length)
+            compressed = self._compress_observation_messages(compressed, max_compressed_length)
         
-        return full_messages
+        return compressed
     
     def _get_compress_config_hash(self, recent_window: int, max_compressed_length: int) -> str:
         """生成压缩配置的哈希值，用于判断是否需要重新压缩"""
-        import hashlib
-        config_str = f"{recent_window}_{max_compressed_length}"
-        return hashlib.md5(config_str.encode()).hexdigest()
+        model_name = os.getenv("OLLAMA_MODEL") or os.getenv("LLM_MODEL", "")
+        config_str = (f"{model_name}_{self.message_compress_threshold}_{recent_window}_"
+                      f"{max_compressed_length}_{COMPRESS_PROMPT_VERSION}")
+        return hashlib.blake2b(config_str.encode()).hexdigest()
     
     def _summarize_older_messages(self, messages: List[Dict[str, str]], state: AgentState) -> str:
         """总结较早的消息
@@ -720,21 +696,28 @@ class ConversationCoordinator:
         
         return json.dumps(compressed, ensure_ascii=False)
     
+    @staticmethod
+    def _parse_tool_result(result: Any) -> tuple:
+        """解析工具结果，返回 (observation, 原始结果是否为合法JSON文本)"""
+        if not isinstance(result, str):
+            return result, False
+        try:
+            return orjson.loads(result), True
+        except orjson.JSONDecodeError:
+            # 如果无法解析，创建一个包含原始字符串的字典
+            return {"raw": result}, False
+    
     def _create_step(self, step_index: int, step_type: str, data: Dict[str, Any]) -> Step:
         """创建步骤对象"""
-        # 处理observation字段 - 如果是字符串则解析为字典
+        # 处理observation字段 - 调用方已解析时直接使用，字符串才需要解析
         observation = data.get("result", {})
         if isinstance(observation, str):
-            try:
-                observation = json.loads(observation)
-            except json.JSONDecodeError:
-                # 如果无法解析，创建一个包含原始字符串的字典
-                observation = {"raw": observation}
+            observation, _ = self._parse_tool_result(observation)
         
         return Step(
             step_index=step_index,
             step_type=step_type,
-            content=json.dumps(data, ensure_ascii=False),
+            content=orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS).decode(),
             timestamp=datetime.now().isoformat(),
             thought=data.get("thought", ""),
             action=data.get("tool_name", ""),
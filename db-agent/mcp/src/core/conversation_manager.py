@@ -1,8 +1,12 @@
 """统一对话管理器 - 整合MCP工具调用、ReAct架构、会话历史等所有功能"""
 
-import json
+import copy
+import orjson
+import os
 import sqlite3
 import threading
+import time
+from contextlib import contextmanager
 import asyncio
 from typing import Dict, Any, List, Optional, AsyncGenerator
 from datetime import datetime
@@ -52,12 +56,44 @@ class ConversationManager:
         self._init_database()
         self._lock = threading.Lock()
         
+        # 只读查询结果缓存（对话详情、对话列表），写操作时按thread_id失效。
+        # 缓存是进程内的，其他worker的写入无法使其失效，因此多worker（API_WORKERS>1）时关闭
+        self._cache_ttl = float(os.getenv("CONVERSATION_CACHE_TTL", "300"))
+        if int(os.getenv("API_WORKERS", "1")) > 1:
+            self._cache_ttl = 0
+        self._read_cache: Dict[tuple, tuple] = {}
+        self._cache_lock = threading.Lock()
+        # 每次失效递增；读取开始前记录版本，写回时版本已变化说明期间有写入，结果作废
+        self._cache_version = 0
+        
         # 创建对话协调器（传递conversation_manager以便恢复历史状态）
         self.coordinator = ConversationCoordinator(tool_registry, conversation_manager=self)
     
+    # 每个连接的性能参数：WAL下NORMAL同步已足够安全，临时表放内存，加大页缓存并启用mmap
+    _CONNECTION_PRAGMAS = (
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA temp_store=MEMORY",
+        "PRAGMA cache_size=-64000",
+        "PRAGMA mmap_size=268435456",
+    )
+    
+    @contextmanager
+    def _connect(self):
+        """打开数据库连接：应用连接参数，退出时提交（异常时回滚）并关闭连接"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            for pragma in self._CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+    
     def _init_database(self):
         """初始化数据库"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
+            # WAL模式持久保存在数据库文件中，读写互不阻塞，只需设置一次
+            conn.execute("PRAGMA journal_mode=WAL")
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS conversations (
                     thread_id TEXT PRIMARY KEY,
@@ -87,10 +123,91 @@ class ConversationManager:
                 ON conversations (user_id)
             """)
             
+            # 时间以ISO字符串写入，可直接按字典序排序；列表查询按(user_id, updated_at)走索引，无需排序
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_conversations_user_updated 
+                ON conversations (user_id, updated_at DESC)
+            """)
+            
             conn.execute("""
                 CREATE INDEX IF NOT EXISTS idx_conversation_steps_thread_id 
                 ON conversation_steps (thread_id)
             """)
+            
+            self._fts_enabled = self._init_fts(conn)
+    
+    def _init_fts(self, conn: sqlite3.Connection) -> bool:
+        """创建对话全文索引（FTS5 trigram，支持中文子串匹配），不可用时返回False"""
+        try:
+            exists = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversations_fts'"
+            ).fetchone()
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts
+                USING fts5(title, question, tokenize = 'trigram')
+            """)
+            # INSERT OR REPLACE 会先删除旧行但不触发DELETE触发器，因此在BEFORE INSERT中清理旧索引
+            conn.executescript("""
+                CREATE TRIGGER IF NOT EXISTS conversations_fts_bi BEFORE INSERT ON conversations BEGIN
+                    DELETE FROM conversations_fts
+                    WHERE rowid = (SELECT rowid FROM conversations WHERE thread_id = new.thread_id);
+                END;
+                CREATE TRIGGER IF NOT EXISTS conversations_fts_ai AFTER INSERT ON conversations BEGIN
+                    INSERT INTO conversations_fts (rowid, title, question)
+                    VALUES (new.rowid, new.title, json_extract(new.state_data, '$.question'));
+                END;
+                CREATE TRIGGER IF NOT EXISTS conversations_fts_au AFTER UPDATE ON conversations BEGIN
+                    DELETE FROM conversations_fts WHERE rowid = old.rowid;
+                    INSERT INTO conversations_fts (rowid, title, question)
+                    VALUES (new.rowid, new.title, json_extract(new.state_data, '$.question'));
+                END;
+                CREATE TRIGGER IF NOT EXISTS conversations_fts_ad AFTER DELETE ON conversations BEGIN
+                    DELETE FROM conversations_fts WHERE rowid = old.rowid;
+                END;
+            """)
+            if not exists:
+                # 首次创建时回填已有对话
+                conn.execute("""
+                    INSERT INTO conversations_fts (rowid, title, question)
+                    SELECT rowid, title, json_extract(state_data, '$.question') FROM conversations
+                """)
+            return True
+        except sqlite3.OperationalError as e:
+            print(f"[ConversationManager] FTS5不可用，搜索回退为LIKE: {e}")
+            return False
+    
+    def _cache_get(self, key: tuple) -> tuple:
+        """读取缓存，返回 (缓存值副本或None, 当前缓存版本)；版本供随后的 _cache_set 使用"""
+        with self._cache_lock:
+            version = self._cache_version
+            entry = self._read_cache.get(key)
+            if entry is None:
+                return None, version
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                self._read_cache.pop(key, None)
+                return None, version
+        # 返回副本，调用方修改返回值不会影响缓存
+        return copy.deepcopy(value), version
+    
+    def _cache_set(self, key: tuple, value: Any, version: int):
+        """写入缓存；读取期间发生过失效（版本变化）时丢弃，避免旧数据回填"""
+        if self._cache_ttl <= 0:
+            return
+        with self._cache_lock:
+            if version == self._cache_version:
+                self._read_cache[key] = (time.monotonic() + self._cache_ttl, copy.deepcopy(value))
+    
+    def invalidate_cache(self, thread_id: Optional[str] = None):
+        """使对话详情缓存和所有列表缓存失效（thread_id为None时清空全部）"""
+        with self._cache_lock:
+            self._cache_version += 1
+            if thread_id is None:
+                self._read_cache.clear()
+                return
+            for key in list(self._read_cache):
+                if key[0] == "list" or key[1:] == (thread_id,):
+                    self._read_cache.pop(key, None)
     
     def create_conversation(self, thread_id: str, question: str, 
                           user_id: str = "default", 
@@ -131,7 +248,7 @@ class ConversationManager:
     def save_conversation(self, metadata: ConversationMetadata, state: AgentState):
         """保存对话到数据库"""
         with self._lock:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 conn.execute("""
                     INSERT OR REPLACE INTO conversations 
                     (thread_id, user_id, title, created_at, updated_at, tool_categories, tags, state_data)
@@ -142,44 +259,151 @@ class ConversationManager:
                     metadata.title,
                     metadata.created_at.isoformat(),
                     metadata.updated_at.isoformat(),
-                    json.dumps(metadata.tool_categories),
-                    json.dumps(metadata.tags),
-                    json.dumps(state.dict())
+                    orjson.dumps(metadata.tool_categories).decode(),
+                    orjson.dumps(metadata.tags).decode(),
+                    orjson.dumps(state.dict(), option=orjson.OPT_NON_STR_KEYS).decode()
                 ))
+            self.invalidate_cache(metadata.thread_id)
     
     def load_conversation(self, thread_id: str) -> Optional[AgentState]:
         """从数据库加载对话"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.execute("""
                 SELECT state_data FROM conversations WHERE thread_id = ?
             """, (thread_id,))
             
             row = cursor.fetchone()
             if row:
-                state_data = json.loads(row[0])
+                state_data = orjson.loads(row[0])
                 return AgentState(**state_data)
             return None
     
+    def get_conversation_data(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        """获取对话状态字典（带缓存，不构造AgentState）
+        
+        缓存原始JSON文本（不可变），命中时重新解析得到独立的字典，免去深拷贝大对象。
+        """
+        key = ("detail", thread_id)
+        cached, version = self._cache_get(key)
+        if cached is not None:
+            return orjson.loads(cached)
+        
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT state_data FROM conversations WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+        if not row:
+            return None
+        
+        self._cache_set(key, row[0], version)
+        return orjson.loads(row[0])
+    
+    def get_conversation_metadata(self, thread_id: str) -> Optional[ConversationMetadata]:
+        """获取对话元数据（tool_categories/tags在加载时解析一次，结果带缓存）"""
+        key = ("meta", thread_id)
+        cached, version = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
+        with self._connect() as conn:
+            row = conn.execute("""
+                SELECT thread_id, user_id, title, created_at, updated_at, tool_categories, tags
+                FROM conversations WHERE thread_id = ?
+            """, (thread_id,)).fetchone()
+        if row is None:
+            return None
+        
+        metadata = ConversationMetadata(
+            thread_id=row[0],
+            user_id=row[1],
+            title=row[2] or "",
+            created_at=datetime.fromisoformat(row[3]) if row[3] else None,
+            updated_at=datetime.fromisoformat(row[4]) if row[4] else None,
+            tool_categories=orjson.loads(row[5] or "[]"),
+            tags=orjson.loads(row[6] or "[]")
+        )
+        self._cache_set(key, metadata, version)
+        return metadata
+    
+    def get_message_chunk(self, thread_id: str, after_key: int = -1, limit: int = 200) -> List[tuple]:
+        """按消息下标分页读取对话消息的JSON文本，返回 [(下标, JSON文本), ...]
+        
+        由SQLite json_each展开，不在Python中解析整个state_data。每次调用使用独立的短连接，
+        可在任意线程中调用（sqlite3连接不能跨线程使用，不能在生成器中跨yield持有）。
+        """
+        with self._connect() as conn:
+            return conn.execute("""
+                SELECT m.key, m.value FROM conversations, json_each(conversations.state_data, '$.messages') AS m
+                WHERE conversations.thread_id = ? AND m.key > ?
+                ORDER BY m.key
+                LIMIT ?
+            """, (thread_id, after_key, limit)).fetchall()
+    
+    def get_conversation_counts(self, thread_id: str) -> Optional[tuple]:
+        """在SQL中统计对话的消息数和步骤数，返回 (messages, steps)，对话不存在时返回None
+        
+        用于只需判断会话是否已有历史的场景，避免解析整个state_data并构造全部Step。
+        """
+        with self._connect() as conn:
+            row = conn.execute("""
+                SELECT json_array_length(state_data, '$.messages'),
+                       json_array_length(state_data, '$.steps')
+                FROM conversations WHERE thread_id = ?
+            """, (thread_id,)).fetchone()
+        if row is None:
+            return None
+        return row[0] or 0, row[1] or 0
+    
+    def _conversation_filters(self, user_id: str, tool_category: Optional[str] = None,
+                              search: Optional[str] = None) -> tuple:
+        """构造对话列表/计数共用的FROM/WHERE子句、参数和排序
+        
+        搜索优先走FTS5全文索引（按bm25相关度排序），trigram要求至少3个字符，
+        更短的搜索词或FTS5不可用时回退为标题LIKE匹配。
+        """
+        source = "conversations"
+        where = "WHERE conversations.user_id = ?"
+        params: List[Any] = [user_id]
+        order = "conversations.updated_at DESC"
+        if tool_category:
+            # 按JSON数组元素精确匹配，避免LIKE通配符误匹配
+            where += " AND EXISTS (SELECT 1 FROM json_each(conversations.tool_categories) WHERE value = ?)"
+            params.append(tool_category)
+        if search:
+            if self._fts_enabled and len(search) >= 3:
+                source = "conversations JOIN conversations_fts ON conversations.rowid = conversations_fts.rowid"
+                where += " AND conversations_fts MATCH ?"
+                # 整体作为短语匹配，避免用户输入被解析为FTS查询语法
+                params.append('"' + search.replace('"', '""') + '"')
+                order = "bm25(conversations_fts), conversations.updated_at DESC"
+            else:
+                # 转义LIKE通配符，用户输入中的 % 和 _ 按字面匹配
+                escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                where += " AND conversations.title LIKE ? ESCAPE '\\'"
+                params.append(f"%{escaped}%")
+        return source, where, params, order
+    
     def list_conversations(self, user_id: str = "default", 
                           tool_category: Optional[str] = None,
-                          limit: int = 100) -> List[Dict[str, Any]]:
-        """列出对话历史"""
-        with sqlite3.connect(self.db_path) as conn:
-            query = """
-                SELECT thread_id, user_id, title, created_at, updated_at, tool_categories, tags
-                FROM conversations 
-                WHERE user_id = ?
-            """
-            params = [user_id]
-            
-            if tool_category:
-                query += " AND tool_categories LIKE ?"
-                params.append(f'%"{tool_category}"%')
-            
-            query += " ORDER BY updated_at DESC LIMIT ?"
-            params.append(limit)
-            
-            cursor = conn.execute(query, params)
+                          limit: int = 100,
+                          offset: int = 0,
+                          search: Optional[str] = None) -> List[Dict[str, Any]]:
+        """列出对话历史（过滤、分页均在SQL中完成，带缓存）"""
+        key = ("list", user_id, tool_category, limit, offset, search)
+        cached, version = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
+        source, where, params, order = self._conversation_filters(user_id, tool_category, search)
+        with self._connect() as conn:
+            cursor = conn.execute(f"""
+                SELECT conversations.thread_id, conversations.user_id, conversations.title,
+                       conversations.created_at, conversations.updated_at,
+                       conversations.tool_categories, conversations.tags
+                FROM {source}
+                {where}
+                ORDER BY {order} LIMIT ? OFFSET ?
+            """, params + [limit, offset])
             conversations = []
             
             for row in cursor.fetchall():
@@ -189,27 +413,81 @@ class ConversationManager:
                     "title": row[2],
                     "created_at": row[3],
                     "updated_at": row[4],
-                    "tool_categories": json.loads(row[5] or "[]"),
-                    "tags": json.loads(row[6] or "[]")
+                    "tool_categories": orjson.loads(row[5] or "[]"),
+                    "tags": orjson.loads(row[6] or "[]")
                 })
             
-            return conversations
+        self._cache_set(key, conversations, version)
+        return conversations
+    
+    def count_conversations(self, user_id: str = "default",
+                            tool_category: Optional[str] = None,
+                            search: Optional[str] = None) -> int:
+        """统计符合条件的对话总数（用于分页）"""
+        key = ("list", "count", user_id, tool_category, search)
+        cached, version = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
+        source, where, params, _ = self._conversation_filters(user_id, tool_category, search)
+        with self._connect() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM {source} {where}", params).fetchone()[0]
+        
+        self._cache_set(key, total, version)
+        return total
+    
+    def get_stats(self, user_id: str = "default", top_n: Optional[int] = None) -> Dict[str, Any]:
+        """对话统计（总数、按工具类别、按创建日期），聚合在SQL中完成
+        
+        Args:
+            user_id: 用户ID
+            top_n: 只返回使用最多的前N个工具类别（None表示全部）
+        """
+        key = ("list", "stats", user_id, top_n)
+        cached, version = self._cache_get(key)
+        if cached is not None:
+            return cached
+        
+        with self._connect() as conn:
+            total = conn.execute(
+                "SELECT COUNT(*) FROM conversations WHERE user_id = ?", (user_id,)
+            ).fetchone()[0]
+            by_category = conn.execute("""
+                SELECT c.value, COUNT(*) FROM conversations, json_each(conversations.tool_categories) AS c
+                WHERE conversations.user_id = ?
+                GROUP BY c.value ORDER BY COUNT(*) DESC
+                LIMIT ?
+            """, (user_id, -1 if top_n is None else top_n)).fetchall()
+            by_date = conn.execute("""
+                SELECT substr(created_at, 1, 10) AS day, COUNT(*) FROM conversations
+                WHERE user_id = ?
+                GROUP BY day ORDER BY day
+            """, (user_id,)).fetchall()
+        
+        stats = {
+            "total": total,
+            "by_tool_category": dict(by_category),
+            "by_date": dict(by_date)
+        }
+        self._cache_set(key, stats, version)
+        return stats
     
     def delete_conversation(self, thread_id: str):
         """删除对话"""
         with self._lock:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 conn.execute("DELETE FROM conversation_steps WHERE thread_id = ?", (thread_id,))
                 conn.execute("DELETE FROM conversations WHERE thread_id = ?", (thread_id,))
+            self.invalidate_cache(thread_id)
     
     def save_step(self, thread_id: str, step: Step):
         """保存对话步骤"""
         with self._lock:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect() as conn:
                 conn.execute("""
                     INSERT INTO conversation_steps (thread_id, step_index, step_data)
                     VALUES (?, ?, ?)
-                """, (thread_id, step.step_index, json.dumps(step.dict())))
+                """, (thread_id, step.step_index, orjson.dumps(step.dict(), option=orjson.OPT_NON_STR_KEYS).decode()))
     
     
     
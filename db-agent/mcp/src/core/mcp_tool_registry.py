@@ -1,22 +1,55 @@
 """统一的MCP工具注册系统 - 替代原有的双重工具系统"""
 
-from typing import Dict, Any, List, Optional, Callable, Union
-from abc import ABC, abstractmethod
-from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Callable, Union, Protocol, runtime_checkable
+from dataclasses import dataclass, field, replace
 from mcp.server.fastmcp import FastMCP
 import inspect
-import json
+import os
+import sys
 
+import orjson
 
-@dataclass
+
+# 工具结果直接交给LLM，缩进只会增加序列化开销和输入token；设置 MCP_PRETTY_JSON=1 可输出缩进格式便于调试
+_RESULT_DUMPS_OPTION = orjson.OPT_NON_STR_KEYS
+if os.getenv("MCP_PRETTY_JSON", "").lower() in ("1", "true", "yes"):
+    _RESULT_DUMPS_OPTION |= orjson.OPT_INDENT_2
+
+
+def _dumps_result(result: Dict[str, Any]) -> str:
+    """序列化工具返回的字典（orjson C实现，无法原生序列化的值转为字符串）"""
+    return orjson.dumps(result, default=str, option=_RESULT_DUMPS_OPTION).decode()
+
+
+@dataclass(slots=True, frozen=True)
 class MCPToolInfo:
-    """MCP工具信息"""
+    """MCP工具信息（不可变、无__dict__）"""
     name: str
     description: str
     category: str
     parameters: Dict[str, Any]
     handler: Callable
     is_async: bool = False
+    # 处理函数签名在创建时解析一次，调用时不再重复 inspect.signature
+    _sig: inspect.Signature = field(init=False, repr=False, compare=False)
+    # 接受**kwargs且没有仅限位置参数的处理函数可直接透传参数，跳过bind
+    _passthrough: bool = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        sig = inspect.signature(self.handler)
+        kinds = {p.kind for p in sig.parameters.values()}
+        object.__setattr__(self, "_sig", sig)
+        object.__setattr__(self, "_passthrough",
+                           inspect.Parameter.VAR_KEYWORD in kinds and
+                           inspect.Parameter.POSITIONAL_ONLY not in kinds)
+    
+    def bind_arguments(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """按处理函数签名校验参数并补全默认值"""
+        if self._passthrough:
+            return kwargs
+        bound_args = self._sig.bind(**kwargs)
+        bound_args.apply_defaults()
+        return bound_args.arguments
 
 
 class ToolCategory:
@@ -27,23 +60,23 @@ class ToolCategory:
     GENERAL = "general"
 
 
-class BaseMCPToolProvider(ABC):
-    """MCP工具提供者基类"""
+@runtime_checkable
+class BaseMCPToolProvider(Protocol):
+    """MCP工具提供者协议（结构化类型，子类可使用__slots__）"""
+    
+    __slots__ = ()
     
-    @abstractmethod
     def get_category(self) -> str:
         """获取工具类别"""
-        pass
+        ...
     
-    @abstractmethod
     def get_tools(self) -> List[MCPToolInfo]:
         """获取工具列表"""
-        pass
+        ...
     
-    @abstractmethod
     def get_system_prompt(self) -> str:
         """获取该类别工具的系统提示词"""
-        pass
+        ...
     
     def get_domain_context(self, state: Any = None) -> List[Dict[str, str]]:
         """获取领域特定上下文（可选实现）"""
@@ -59,15 +92,28 @@ class MCPToolRegistry:
         self._tools: Dict[str, MCPToolInfo] = {}
         self._categories: Dict[str, List[str]] = {}
         self._registered_tools: List[str] = []
+        # 组合提示词/领域上下文提供者缓存，只在提供者注册变化时失效
+        self._prompt_cache: Dict[tuple, str] = {}
+        self._context_providers_cache: Dict[tuple, List[BaseMCPToolProvider]] = {}
+    
+    def _invalidate_caches(self):
+        """提供者或类别变化时清空组合缓存"""
+        self._prompt_cache.clear()
+        self._context_providers_cache.clear()
     
     def register_provider(self, provider: BaseMCPToolProvider):
         """注册工具提供者"""
-        category = provider.get_category()
+        if not isinstance(provider, BaseMCPToolProvider):
+            raise TypeError(f"{type(provider).__name__} 未实现 BaseMCPToolProvider 协议")
+        category = sys.intern(provider.get_category())
         self._providers[category] = provider
+        self._invalidate_caches()
         
         # 注册该提供者的所有工具到MCP服务器
         tools = provider.get_tools()
         for tool in tools:
+            # 驻留工具名和类别，字典查找时可直接按身份比较
+            tool = replace(tool, name=sys.intern(tool.name), category=sys.intern(tool.category))
             self._register_tool_to_mcp(tool)
             self._tools[tool.name] = tool
             
@@ -81,19 +127,17 @@ class MCPToolRegistry:
         async def tool_wrapper(**kwargs):
             try:
                 # 检查参数
-                sig = inspect.signature(tool.handler)
-                bound_args = sig.bind(**kwargs)
-                bound_args.apply_defaults()
+                arguments = tool.bind_arguments(kwargs)
                 
                 # 执行工具
                 if tool.is_async:
-                    result = await tool.handler(**bound_args.arguments)
+                    result = await tool.handler(**arguments)
                 else:
-                    result = tool.handler(**bound_args.arguments)
+                    result = tool.handler(**arguments)
                 
                 # 确保返回字符串格式（MCP要求）
                 if isinstance(result, dict):
-                    return json.dumps(result, ensure_ascii=False, indent=2)
+                    return _dumps_result(result)
                 elif isinstance(result, str):
                     return result
                 else:
@@ -105,7 +149,7 @@ class MCPToolRegistry:
                     "code": "EXECUTION_ERROR",
                     "message": str(e)
                 }
-                return json.dumps(error_result, ensure_ascii=False, indent=2)
+                return _dumps_result(error_result)
         
         # 使用MCP装饰器注册工具
         decorated_func = self.mcp_server.tool(
@@ -125,13 +169,13 @@ class MCPToolRegistry:
         """直接注册单个函数为工具 - 支持装饰器和直接调用两种方式"""
         
         def _register(f):
-            tool_name = name or f.__name__
+            tool_name = sys.intern(name or f.__name__)
             tool_desc = description or f.__doc__ or f"Tool: {tool_name}"
             
             tool_info = MCPToolInfo(
                 name=tool_name,
                 description=tool_desc,
-                category=category,
+                category=sys.intern(category),
                 parameters=parameters or {},
                 handler=f,
                 is_async=inspect.iscoroutinefunction(f)
@@ -143,6 +187,7 @@ class MCPToolRegistry:
             if category not in self._categories:
                 self._categories[category] = []
             self._categories[category].append(tool_name)
+            self._invalidate_caches()
             
             return f
         
@@ -152,6 +197,22 @@ class MCPToolRegistry:
         else:
             return _register(func)
     
+    def register_pending_tools(self) -> int:
+        """注册所有由 @mcp_tool 装饰、尚未进入注册中心的函数，返回注册数量"""
+        count = 0
+        while _PENDING_TOOLS:
+            func = _PENDING_TOOLS.pop(0)
+            info = func._mcp_tool_info
+            self.register_function(
+                func,
+                name=info['name'],
+                description=info['description'],
+                category=info['category'],
+                parameters=info['parameters']
+            )
+            count += 1
+        return count
+    
     def get_tool(self, tool_name: str) -> Optional[MCPToolInfo]:
         """获取工具信息"""
         return self._tools.get(tool_name)
@@ -177,15 +238,13 @@ class MCPToolRegistry:
         
         try:
             # 检查参数
-            sig = inspect.signature(tool.handler)
-            bound_args = sig.bind(**kwargs)
-            bound_args.apply_defaults()
+            arguments = tool.bind_arguments(kwargs)
             
             # 执行工具
             if tool.is_async:
-                result = await tool.handler(**bound_args.arguments)
+                result = await tool.handler(**arguments)
             else:
-                result = tool.handler(**bound_args.arguments)
+                result = tool.handler(**arguments)
             
             return result
                 
@@ -206,31 +265,42 @@ class MCPToolRegistry:
     
     def get_combined_system_prompt(self, categories: List[str] = None) -> str:
         """获取组合的系统提示词"""
-        if categories is None:
-            categories = self.get_categories()
+        # 拼接顺序取决于类别顺序，因此按元组而不是集合作为缓存键
+        key = tuple(self._categories if categories is None else categories)
+        cached = self._prompt_cache.get(key)
+        if cached is not None:
+            return cached
         
         prompts = []
-        for category in categories:
+        for category in key:
             provider = self._providers.get(category)
             if provider:
                 prompts.append(f"## {category.upper()}工具\n{provider.get_system_prompt()}")
         
-        return "\n\n".join(prompts)
+        combined = self._prompt_cache[key] = "\n\n".join(prompts)
+        return combined
     
     def get_combined_domain_context(self, state: Any = None, categories: List[str] = None) -> List[Dict[str, str]]:
         """获取组合的领域上下文"""
-        if categories is None:
-            categories = self.get_categories()
+        # 领域上下文依赖state，只缓存类别到提供者的解析结果
+        key = tuple(self._categories if categories is None else categories)
+        providers = self._context_providers_cache.get(key)
+        if providers is None:
+            providers = self._context_providers_cache[key] = [
+                self._providers[category] for category in key if category in self._providers
+            ]
         
         context = []
-        for category in categories:
-            provider = self._providers.get(category)
-            if provider:
-                context.extend(provider.get_domain_context(state))
+        for provider in providers:
+            context.extend(provider.get_domain_context(state))
         
         return context
 
 
+# 已装饰但尚未注册的工具函数，由 MCPToolRegistry.register_pending_tools 延迟注册
+_PENDING_TOOLS: List[Callable] = []
+
+
 # 工具装饰器 - 用于快速注册单个工具函数
 def mcp_tool(name: str = None, 
              description: str = None, 
@@ -244,14 +314,15 @@ def mcp_tool(name: str = None,
         return {"result": f"处理 {param1} 和 {param2}"}
     """
     def decorator(func):
-        # 注意：这里不能立即注册，因为可能还没有registry实例
-        # 实际注册会在registry.register_function被调用时进行
+        # 导入时不触碰注册中心，只登记到待注册列表；
+        # 实际注册在获取注册中心时由 register_pending_tools 完成
         func._mcp_tool_info = {
             'name': name or func.__name__,
             'description': description or func.__doc__ or f"Tool: {func.__name__}",
             'category': category,
             'parameters': parameters or {}
         }
+        _PENDING_TOOLS.append(func)
         return func
     return decorator
 
@@ -1,44 +1,116 @@
 """ReAct推理引擎 - 专门负责ReAct架构的实现"""
 
+import hashlib
 import json
 import os
+import time
+from collections import OrderedDict
 from typing import Dict, Any, List, Optional, AsyncGenerator, TYPE_CHECKING
 from datetime import datetime
 import httpx
+import orjson
 
-from .schemas import FlexibleDecideOut, validate_flexible_decide, get_flexible_system_prompt
+from .schemas import (
+    FlexibleDecideOut, validate_flexible_decide, get_flexible_system_prompt,
+    FLEXIBLE_DECIDE_JSON_SCHEMA
+)
 from .mcp_tool_registry import MCPToolRegistry
 
 if TYPE_CHECKING:
     from .schemas import AgentState
 
 
+# 决策调用使用供应商原生结构化输出（OpenAI兼容的 response_format）引导模型输出JSON。
+# strict=False：决策Schema含开放的 args 对象及可选字段，不满足严格模式（对象全封闭、字段全必填）的要求，
+# 以严格模式发送会被兼容供应商以400拒绝
+DECIDE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "flexible_decide",
+        "strict": False,
+        "schema": FLEXIBLE_DECIDE_JSON_SCHEMA
+    }
+}
+
+
+class _FallbackResponse(str):
+    """LLM不可用时的后备响应文本；用类型标记与真实LLM输出区分，后备决策不写入决策缓存"""
+
+
 class ReActEngine:
     """ReAct推理引擎 - 负责思考-行动-观察循环"""
     
     def __init__(self, tool_registry: MCPToolRegistry):
         self.tool_registry = tool_registry
-        
-    async def execute_react_step(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        # 提示词哈希 -> (过期时间, 已验证决策) 的LRU缓存（重试/评测时相同提示直接复用，跳过LLM调用和验证）
+        self._decision_cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._decision_cache_size = int(os.getenv("LLM_DECISION_CACHE_SIZE", "1024"))
+        self._decision_cache_ttl = float(os.getenv("LLM_DECISION_CACHE_TTL", "300"))
+    
+    def _decision_cache_key(self, messages: List[Dict[str, str]], use_structured: bool) -> bytes:
+        """根据模型配置和完整消息列表计算决策缓存键"""
+        config = [
+            os.getenv("LLM_PROVIDER", "ollama"),
+            os.getenv("OLLAMA_MODEL"), os.getenv("LLM_MODEL"),
+            os.getenv("LLM_TEMPERATURE", "0.1"), use_structured
+        ]
+        return hashlib.blake2b(orjson.dumps([config, messages]), digest_size=16).digest()
+    
+    def _cached_decision(self, key: bytes) -> Optional[FlexibleDecideOut]:
+        """读取未过期的缓存决策，过期条目直接删除"""
+        entry = self._decision_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, decision = entry
+        if time.monotonic() >= expires_at:
+            del self._decision_cache[key]
+            return None
+        self._decision_cache.move_to_end(key)
+        return decision
+    
+    def _cache_decision(self, key: bytes, decision: FlexibleDecideOut):
+        """写入决策缓存，超出容量时淘汰最久未使用的条目"""
+        self._decision_cache[key] = (time.monotonic() + self._decision_cache_ttl, decision)
+        self._decision_cache.move_to_end(key)
+        while len(self._decision_cache) > self._decision_cache_size:
+            self._decision_cache.popitem(last=False)
+        
+    async def execute_react_step(self, messages: List[Dict[str, str]], use_cache: bool = False) -> Dict[str, Any]:
         """执行一个ReAct步骤
         
         Args:
             messages: 对话历史消息
+            use_cache: 是否使用决策缓存（相同提示直接复用已验证的决策）
             
         Returns:
             包含步骤类型和内容的字典
         """
         print(f"[ReAct Engine] 开始执行ReAct步骤，消息数量: {len(messages)}")
         
-        # 调用LLM获取决策
-        llm_response = await self._call_llm(messages)
+        use_structured = os.getenv("LLM_STRUCTURED_OUTPUT", "true").lower() == "true"
+        use_cache = use_cache and self._decision_cache_size > 0
+        cache_key = self._decision_cache_key(messages, use_structured) if use_cache else None
+        decision = self._cached_decision(cache_key) if use_cache else None
+        if decision is not None:
+            print(f"[ReAct Engine] 命中决策缓存: step_type={decision.step_type}")
+            return await self._dispatch_decision(decision, messages)
+        
+        # 调用LLM获取决策（一次调用同时给出思考和行动）
+        llm_response = await self._call_llm(
+            messages, response_format=DECIDE_RESPONSE_FORMAT if use_structured else None
+        )
         print(f"[ReAct Engine] LLM响应类型: {type(llm_response)}, 长度: {len(str(llm_response)) if llm_response else 0}")
         
         # 解析LLM响应
         try:
             print(f"[ReAct Engine] 开始解析LLM响应...")
             if isinstance(llm_response, str):
-                response_dict = self._extract_json_from_response(llm_response)
+                try:
+                    # 结构化输出下响应本身就是合法JSON
+                    response_dict = json.loads(llm_response)
+                except json.JSONDecodeError:
+                    # 兜底：供应商不支持结构化输出时从自由文本中提取
+                    response_dict = self._extract_json_from_response(llm_response)
                 print(f"[ReAct Engine] [SUCCESS] JSON提取成功: {response_dict.keys()}")
             else:
                 response_dict = llm_response
@@ -54,7 +126,7 @@ class ReActEngine:
         except Exception as e:
             print(f"[ReAct Engine] [ERROR] 响应解析失败: {type(e).__name__}: {e}")
             print(f"[ReAct Engine] 原始响应（前500字符）: {str(llm_response)[:500]}")
-            # 返回错误类型，让协调器可以将错误信息添加到对话历史并重试
+            # 返回错误类型，由协调器记录错误步骤
             return {
                 "type": "error",
                 "data": {
@@ -65,7 +137,15 @@ class ReActEngine:
                 }
             }
         
-        # 根据决策类型执行相应操作
+        # 只缓存真实LLM输出得到的决策；后备响应（LLM超时/不可用）不缓存，下次仍会重新调用LLM
+        if use_cache and not isinstance(llm_response, _FallbackResponse):
+            self._cache_decision(cache_key, decision)
+        
+        return await self._dispatch_decision(decision, messages)
+    
+    async def _dispatch_decision(self, decision: FlexibleDecideOut,
+                                 messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """根据决策类型执行相应操作"""
         if decision.step_type == "reasoning":
             return await self._handle_reasoning_step(decision)
         elif decision.step_type == "action":
@@ -214,8 +294,14 @@ class ReActEngine:
             }
         }
     
-    async def _call_llm(self, messages: List[Dict[str, str]]) -> str:
-        """调用LLM获取推理结果"""
+    async def _call_llm(self, messages: List[Dict[str, str]],
+                        response_format: Optional[Dict[str, Any]] = None) -> str:
+        """调用LLM获取推理结果
+        
+        Args:
+            messages: 对话消息
+            response_format: 可选的结构化输出约束（OpenAI兼容格式），为None时输出自由文本
+        """
         # 从环境变量读取LLM配置
         llm_provider = os.getenv("LLM_PROVIDER", "ollama")
         
@@ -270,16 +356,17 @@ class ReActEngine:
                     print(f"[ReAct Engine] 正在调用LLM: {llm_api_url}")
                     print(f"[ReAct Engine] 请求参数: model={llm_model}, temperature={llm_temperature}, max_tokens={llm_max_tokens}")
                     
-                    response = await client.post(
-                        llm_api_url,
-                        json={
-                            "model": llm_model,
-                            "messages": messages,
-                            "temperature": llm_temperature,
-                            "max_tokens": llm_max_tokens,
-                            "stream": False
-                        }
-                    )
+                    payload = {
+                        "model": llm_model,
+                        "messages": messages,
+                        "temperature": llm_temperature,
+                        "max_tokens": llm_max_tokens,
+                        "stream": False
+                    }
+                    if response_format:
+                        payload["response_format"] = response_format
+                    
+                    response = await client.post(llm_api_url, json=payload)
                     
                 print(f"[ReAct Engine] [SUCCESS] HTTP状态码: {response.status_code}")
                 
@@ -452,13 +539,13 @@ class ReActEngine:
         return False
     
     def _fallback_response(self, messages: List[Dict[str, str]]) -> str:
-        """当LLM不可用时的后备响应"""
-        return json.dumps({
+        """当LLM不可用时的后备响应（_FallbackResponse 类型，调用方据此识别后备结果）"""
+        return _FallbackResponse(json.dumps({
             "thought": "LLM服务暂时不可用，无法进行智能推理。",
             "step_type": "finish",
             "answer": "抱歉，LLM服务暂时不可用，无法处理您的请求。请检查以下配置：\n\n1. 确认LLM服务正在运行\n2. 检查环境变量配置：\n   - OLLAMA_BASE: 当前配置为 " + os.getenv("OLLAMA_BASE", "未配置") + "\n   - OLLAMA_MODEL: 当前配置为 " + os.getenv("OLLAMA_MODEL", "未配置") + "\n\n请联系管理员或稍后重试。",
             "rationale": "LLM服务连接失败"
-        }, ensure_ascii=False)
+        }, ensure_ascii=False))
     
     def build_system_message(self, state: Optional['AgentState'] = None) -> Dict[str, str]:
         """构建系统消息
@@ -539,12 +626,21 @@ class ReActEngine:
             "content": base_prompt
         }
     
-    def build_observation_message(self, tool_name: str, tool_result: Any) -> Dict[str, str]:
-        """构建观察消息"""
+    def build_observation_message(self, tool_name: str, tool_result: Any,
+                                  validated_json: bool = False) -> Dict[str, str]:
+        """构建观察消息
+        
+        Args:
+            tool_name: 工具名
+            tool_result: 工具结果
+            validated_json: 调用方已确认tool_result是合法JSON文本时为True，跳过重复解析
+        """
         # 处理工具结果：如果已经是字符串（可能是JSON字符串），直接使用
         # 如果是字典，转换为JSON字符串
         # 如果是其他类型，转换为字符串
-        if isinstance(tool_result, str):
+        if validated_json and isinstance(tool_result, str):
+            content = tool_result
+        elif isinstance(tool_result, str):
             # 如果已经是字符串，检查是否是有效的JSON
             try:
                 # 尝试解析，如果成功说明是JSON字符串，直接使用
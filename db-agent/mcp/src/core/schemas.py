@@ -1,7 +1,10 @@
 """Schemas for MCP Client - 统一的ReAct模式支持"""
 
-from pydantic import BaseModel, Field, ValidationError, validator
-from typing import Literal, Dict, Any, List, Optional
+import hashlib
+import orjson
+from collections import Counter
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, TypeAdapter, ValidationError, ValidationInfo, field_validator
+from typing import Annotated, Literal, Dict, Any, List, Optional, Callable, Union
 
 # 步骤类型
 StepType = Literal[
@@ -12,7 +15,7 @@ StepType = Literal[
 
 # 原有的动作类型
 ActionName = Literal[
-    "list_tables", "describe_table", "sample_rows", "run_sql", "finish"
+    "list_tables", "describe_table", "describe_tables", "sample_rows", "run_sql", "get_table_stats", "finish"
 ]
 
 class DecideOut(BaseModel):
@@ -20,6 +23,47 @@ class DecideOut(BaseModel):
     action: ActionName
     args: Dict[str, Any] = Field(default_factory=dict)
 
+# 各工具动作的参数模型，按action标签区分（判别联合，按标签O(1)选择模型）；
+# 多余参数忽略，类型不符时原样交给工具，由工具返回常规错误观察
+class ListTablesArgs(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    action: Literal["list_tables"]
+
+class DescribeTableArgs(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    action: Literal["describe_table"]
+    table: str
+
+class DescribeTablesArgs(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    action: Literal["describe_tables"]
+    tables: str
+
+class SampleRowsArgs(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    action: Literal["sample_rows"]
+    table: str
+    limit: int = 2
+    columns: Optional[str] = None
+
+class RunSqlArgs(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    action: Literal["run_sql"]
+    sql: str
+    limit: int = 100
+    columnar: bool = False
+
+class TableStatsArgs(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    action: Literal["get_table_stats"]
+    table: str
+
+ActionArgs = Annotated[
+    Union[ListTablesArgs, DescribeTableArgs, DescribeTablesArgs, SampleRowsArgs, RunSqlArgs, TableStatsArgs],
+    Field(discriminator="action")
+]
+ACTION_ARGS_ADAPTER = TypeAdapter(ActionArgs)
+
 class FlexibleDecideOut(BaseModel):
     """灵活的决策输出模型，支持推理和行动的分离"""
     thought: str = Field(description="详细的思考过程")
@@ -37,24 +81,47 @@ class FlexibleDecideOut(BaseModel):
     plan: Optional[List[str]] = Field(default=None, description="制定的计划步骤")
     analysis: Optional[str] = Field(default=None, description="分析结果")
     
-    @validator('action')
-    def validate_action_for_action_step(cls, v, values):
+    @field_validator('action')
+    @classmethod
+    def validate_action_for_action_step(cls, v, info: ValidationInfo):
         """验证action步骤必须有action字段"""
+        values = info.data
         if values.get('step_type') == 'action' and v is None:
             raise ValueError("action步骤必须指定action字段")
         if values.get('step_type') != 'action' and v is not None:
             raise ValueError("只有action步骤才能指定action字段")
         return v
     
-    @validator('answer')
-    def validate_answer_for_finish_step(cls, v, values):
+    @field_validator('args')
+    @classmethod
+    def validate_args_for_action(cls, v, info: ValidationInfo):
+        """按action标签校验工具参数，未显式给出的默认值留给工具函数
+        
+        参数小错误（类型不符等）不使整个决策失效：原样透传给工具，由工具报告错误
+        """
+        action = info.data.get('action')
+        if action is None or action == 'finish':
+            return v
+        try:
+            parsed = ACTION_ARGS_ADAPTER.validate_python({**v, "action": action})
+        except ValidationError:
+            return v
+        return parsed.model_dump(exclude_unset=True, exclude={"action"})
+    
+    @field_validator('answer')
+    @classmethod
+    def validate_answer_for_finish_step(cls, v, info: ValidationInfo):
         """验证finish步骤必须有answer字段"""
+        values = info.data
         if values.get('step_type') == 'finish' and v is None:
             raise ValueError("finish步骤必须指定answer字段")
         if values.get('step_type') != 'finish' and v is not None:
             raise ValueError("只有finish步骤才能指定answer字段")
         return v
 
+# 供应商结构化输出（JSON Schema）使用的决策模型Schema，导入时生成一次
+FLEXIBLE_DECIDE_JSON_SCHEMA = FlexibleDecideOut.model_json_schema()
+
 class Step(BaseModel):
     step_index: int = 0
     thought: str = ""
@@ -97,10 +164,92 @@ class AgentState(BaseModel):
     done: bool = False
     answer: Optional[Dict[str, Any]] = None
     max_steps: int = 12
+    use_action_cache: bool = Field(default=False, description="是否复用相同提示词的已验证决策（跳过LLM调用，默认关闭）")
     # 压缩消息的缓存（避免每次重新计算）
     compressed_summary: Optional[str] = Field(default=None, description="历史消息的压缩摘要")
     compressed_message_count: int = Field(default=0, description="被压缩的消息数量")
     compressed_config_hash: Optional[str] = Field(default=None, description="压缩配置的哈希值（用于判断是否需要重新压缩）")
+    # 历史记录的列式索引（不序列化）：已执行SQL的哈希集合、错误类型计数，查询为O(1)
+    _sql_seen: set = PrivateAttr(default_factory=set)
+    _error_codes: Counter = PrivateAttr(default_factory=Counter)
+    
+    def model_post_init(self, __context: Any) -> None:
+        """从已持久化的历史记录重建索引"""
+        self._sql_seen.update(self._sql_key(item.get("sql", "")) for item in self.sql_history)
+        self._error_codes.update(self._error_code(item) for item in self.error_history)
+    
+    @staticmethod
+    def _sql_key(sql: str) -> str:
+        return hashlib.md5(sql.strip().encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def _error_code(error_info: Dict[str, Any]) -> str:
+        return error_info.get("error_type") or error_info.get("code") or "unknown"
+    
+    def has_run_sql(self, sql: str) -> bool:
+        """该SQL是否已执行过"""
+        return self._sql_key(sql) in self._sql_seen
+    
+    def record_sql(self, sql: str, result: Any, timestamp: Optional[str] = None) -> bool:
+        """记录一次SQL执行，已记录过的SQL不重复追加；返回是否为新记录"""
+        key = self._sql_key(sql)
+        if key in self._sql_seen:
+            return False
+        self._sql_seen.add(key)
+        self.sql_history.append({"sql": sql, "result": result, "timestamp": timestamp})
+        return True
+    
+    def record_error(self, error_info: Dict[str, Any]):
+        """记录一次错误并更新错误类型计数"""
+        self.error_history.append(error_info)
+        self._error_codes[self._error_code(error_info)] += 1
+    
+    def error_count(self, code: str) -> int:
+        """指定错误类型已出现的次数"""
+        return self._error_codes[code]
+    
+    def effective_messages(self, messages: List[Dict[str, str]],
+                           compressor: Callable[[List[Dict[str, str]]], str],
+                           t_hist: int, keep_recent: int, config_hash: str) -> List[Dict[str, str]]:
+        """获取实际发送给LLM的消息列表（带阈值门控的压缩缓存）
+        
+        已压缩的旧消息用缓存摘要替代，其后的消息原样保留。只有当摘要之后累积的
+        消息数超过 t_hist 或压缩配置哈希变化时，才调用 compressor 重新压缩
+        （保留最近 keep_recent 条），并回写三个压缩缓存字段。
+        
+        Args:
+            messages: 完整消息列表（可以以系统消息开头）
+            compressor: 将旧消息压缩为摘要文本的函数
+            t_hist: 未压缩消息数阈值
+            keep_recent: 重新压缩时保留的最近消息数
+            config_hash: 当前压缩配置的哈希值
+        """
+        system_msg = messages[0] if messages and messages[0].get("role") == "system" else None
+        conversation = messages[1:] if system_msg else messages
+        
+        cache_valid = (
+            self.compressed_summary is not None and
+            self.compressed_config_hash == config_hash and
+            self.compressed_message_count <= len(conversation) and
+            len(conversation) - self.compressed_message_count <= t_hist
+        )
+        if not cache_valid:
+            if len(conversation) <= t_hist:
+                # 消息数量不多，无需压缩
+                return messages
+            older_messages = conversation[:-keep_recent] if keep_recent > 0 else conversation
+            self.compressed_summary = compressor(older_messages)
+            self.compressed_message_count = len(older_messages)
+            self.compressed_config_hash = config_hash
+        
+        result = [system_msg] if system_msg else []
+        if self.compressed_summary:
+            result.append({
+                "role": "system",
+                "content": f"## 历史对话摘要（已压缩{self.compressed_message_count}条消息）\n\n{self.compressed_summary}"
+            })
+        result.extend(conversation[self.compressed_message_count:])
+        return result
 
 class FlexibleAgentState(BaseModel):
     """支持灵活ReAct模式的Agent状态"""
@@ -152,9 +301,8 @@ def validate_flexible_decide(obj: dict) -> FlexibleDecideOut:
             # 处理answer字段类型转换
             answer_value = obj.get('answer', '')
             if isinstance(answer_value, list):
-                # 如果answer是列表，转换为JSON字符串
-                import json
-                answer_str = json.dumps(answer_value, ensure_ascii=False, indent=2)
+                # 如果answer是列表，转换为紧凑JSON字符串（美化留给展示层）
+                answer_str = orjson.dumps(answer_value, option=orjson.OPT_NON_STR_KEYS).decode()
             else:
                 answer_str = str(answer_value)
             
@@ -166,13 +314,23 @@ def validate_flexible_decide(obj: dict) -> FlexibleDecideOut:
             )
         
         # 如果包含action字段，可能是想执行动作
-        if 'action' in obj and obj['action'] in ['list_tables', 'describe_table', 'sample_rows', 'run_sql']:
-            return FlexibleDecideOut(
-                thought=obj.get('thought', '执行工具操作'),
-                step_type='action',
-                action=obj['action'],
-                args=obj.get('args', {})
-            )
+        if 'action' in obj and obj['action'] in ['list_tables', 'describe_table', 'describe_tables', 'sample_rows', 'run_sql', 'get_table_stats']:
+            args = obj.get('args')
+            try:
+                return FlexibleDecideOut(
+                    thought=str(obj.get('thought', '执行工具操作')),
+                    step_type='action',
+                    action=obj['action'],
+                    args=args if isinstance(args, dict) else {}
+                )
+            except ValidationError:
+                # 参数仍无法构造：跳过校验直接透传，由工具返回错误观察
+                return FlexibleDecideOut.model_construct(
+                    thought=str(obj.get('thought', '执行工具操作')),
+                    step_type='action',
+                    action=obj['action'],
+                    args=args if isinstance(args, dict) else {}
+                )
         
         # 默认fallback到推理步骤
         return FlexibleDecideOut(
@@ -204,8 +362,10 @@ def get_flexible_system_prompt() -> str:
 
 1. **list_tables**: 列出数据库中的所有表
 2. **describe_table**: 获取指定表的结构信息（字段名、类型等）
-3. **sample_rows**: 获取表的示例数据（**用于回答"举例"、"展示"等问题**）
-4. **run_sql**: 执行SQL查询（**用于回答需要实际数据的问题**）
+3. **describe_tables**: 批量获取多个表的结构信息（参数 tables 为逗号分隔的表名）
+4. **sample_rows**: 获取表的示例数据（**用于回答"举例"、"展示"等问题**）
+5. **run_sql**: 执行SQL查询（**用于回答需要实际数据的问题**）
+6. **get_table_stats**: 获取表的统计信息（行数、字段数；大表行数为估算值）
 
 ## ReAct工作模式
 
@@ -217,39 +377,13 @@ def get_flexible_system_prompt() -> str:
 
 ## 响应格式
 
-请严格按照以下JSON格式回复：
-
-### 推理步骤
-```json
-{
-  "thought": "你的详细思考过程",
-  "step_type": "reasoning",
-  "analysis": "当前情况分析",
-  "plan": ["计划步骤1", "计划步骤2"]
-}
-```
-
-### 行动步骤
-```json
-{
-  "thought": "为什么要执行这个工具",
-  "step_type": "action", 
-  "action": "工具名称",
-  "args": {"参数名": "参数值"}
-}
-```
-
-### 完成步骤（finish）
-```json
-{
-  "thought": "为什么现在可以给出答案",
-  "step_type": "finish",
-  "answer": "简洁、用户友好的最终答案",
-  "rationale": "完成的理由"
-}
-```
-
-**finish的严格要求**：
+每一步只输出一个纯JSON对象，不要包含其他文本：
+- 推理步骤: `{"thought": "...", "step_type": "reasoning", "analysis": "...", "plan": ["..."]}`
+- 行动步骤: `{"thought": "...", "step_type": "action", "action": "工具名称", "args": {"参数名": "参数值"}}`
+- 完成步骤: `{"thought": "...", "step_type": "finish", "answer": "简洁的用户友好回答", "rationale": "..."}`
+
+## finish的严格要求
+
 - ✅ 必须**已执行查询工具**（sample_rows或run_sql）并获取实际数据后才能finish
 - ✅ 回答必须简洁、用户友好，提取关键信息
 - ❌ **禁止**在用户要求"举例"、"展示"时直接finish
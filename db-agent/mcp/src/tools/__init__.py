@@ -35,6 +35,9 @@ def initialize_mcp_tools(mcp_server):
     # 注册数据库工具
     register_database_mcp_tools(tool_registry)
     
+    # 注册通过 @mcp_tool 装饰器声明的工具
+    tool_registry.register_pending_tools()
+    
     # 如果需要图表工具，可以在这里添加
     # register_chart_mcp_tools(tool_registry)
     
@@ -1,17 +1,26 @@
 """数据库工具函数模块"""
 
+import copy
 import os
+import re
 import sys
-import json
-from datetime import datetime, date
-from typing import Dict, Any, List, Optional
-from sqlalchemy import create_engine, text, inspect
-from sqlalchemy.exc import ProgrammingError, OperationalError, NoSuchTableError
-from dotenv import load_dotenv
-from .field_selector import SmartFieldSelector
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from datetime import datetime, date, time as dt_time
+from decimal import Decimal
+from typing import Dict, Any, List, Optional, Tuple, Callable
+from .field_selector import get_default_selector
 
-# 加载环境变量
-load_dotenv()
+# 加载环境变量（设置 SKIP_DOTENV=1 可跳过，例如环境变量已由部署平台注入时）
+if os.getenv("SKIP_DOTENV") != "1":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+# SQLAlchemy 在首次访问数据库时才导入（见 _get_engine），
+# 未调用数据库工具的进程无需承担其导入耗时和内存占用
 
 # 添加core目录到Python路径
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -26,16 +35,55 @@ except ImportError:
     from agent_mcp.core.guard import ensure_safe_sql
 
 
-def _convert_row_data(data):
-    """转换行数据中的datetime对象为字符串"""
-    if isinstance(data, list):
-        return [_convert_row_data(item) for item in data]
-    elif isinstance(data, dict):
-        return {key: _convert_row_data(value) for key, value in data.items()}
-    elif isinstance(data, (datetime, date)):
-        return data.isoformat()
-    else:
-        return data
+# 匹配 SELECT ... FROM table_name 的模式（模块加载时编译一次；IGNORECASE避免每次对整条SQL做upper()拷贝）
+_SELECT_RE = re.compile(r'SELECT\s+(.*?)\s+FROM\s+(\w+)', re.IGNORECASE | re.DOTALL)
+
+def _serialize_datetime(obj: Any) -> Any:
+    """JSON编码器的default钩子：处理orjson无法原生序列化的类型
+    
+    orjson在C层原生按ISO 8601格式化datetime/date/time，这些值不会进入本钩子；
+    datetime分支仅作为其他编码器（如标准库json）的兜底。
+    按实际出现频率排列判断顺序：数值列的Decimal最常见。
+    """
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return bytes(obj).hex()
+    if isinstance(obj, (datetime, date, dt_time)):
+        return obj.isoformat()
+    return str(obj)
+
+@lru_cache(maxsize=1024)
+def _check_sql_safety(normalized_sql: str) -> Optional[str]:
+    """检查SQL是否安全，返回不安全的原因；安全时返回None
+    
+    Args:
+        normalized_sql: 折叠空白后的SQL，作为缓存键
+    """
+    try:
+        ensure_safe_sql(normalized_sql)
+    except ValueError as e:
+        return f"SQL语句包含潜在的不安全操作: {e}"
+    return None
+
+@lru_cache(maxsize=512)
+def _cached_field_selection(columns: Tuple[str, ...], question: str) -> Tuple[Tuple[str, ...], Dict[str, Any]]:
+    """按 (表字段, 问题) 缓存字段选择结果及其说明，重复的问题无需重新打分"""
+    selector = get_default_selector()
+    available_fields = list(columns)
+    selected_fields = selector.select_relevant_fields(question, available_fields)
+    explanation = selector.explain_selection(question, available_fields, selected_fields)
+    return tuple(selected_fields), explanation
+
+def _select_fields(table_columns: List[str], question: str) -> Tuple[List[str], Dict[str, Any]]:
+    """智能选择与问题相关的字段
+    
+    Returns:
+        tuple: (选择的字段列表, 选择说明)
+    """
+    selected_fields, explanation = _cached_field_selection(tuple(table_columns), question)
+    # 说明字典为缓存共享对象，返回副本避免调用方修改缓存
+    return list(selected_fields), copy.deepcopy(explanation)
 
 def _optimize_select_query(sql: str, question: str) -> tuple:
     """优化SELECT查询的字段选择
@@ -47,13 +95,13 @@ def _optimize_select_query(sql: str, question: str) -> tuple:
     Returns:
         tuple: (优化后的SQL, 优化信息)
     """
+    # 快速预检：只有 SELECT * 查询才有优化空间，避免对其他语句做正则匹配
+    if sql.lstrip()[:6].upper() != "SELECT" or "*" not in sql[:200]:
+        return sql, None
+    
     try:
-        import re
-        
         # 简单的SQL解析，提取表名和字段
-        # 匹配 SELECT ... FROM table_name 的模式
-        select_pattern = r'SELECT\s+(.*?)\s+FROM\s+(\w+)'
-        match = re.search(select_pattern, sql.upper())
+        match = _SELECT_RE.search(sql)
         
         if not match:
             return sql, None
@@ -67,16 +115,14 @@ def _optimize_select_query(sql: str, question: str) -> tuple:
             
         # 获取表的字段信息
         engine = _get_engine()
-        inspector = inspect(engine)
         
-        if table_name not in inspector.get_table_names():
+        if table_name not in _cached_table_name_set(engine):
             return sql, None
             
-        table_columns = [col["name"] for col in inspector.get_columns(table_name)]
+        table_columns = [col["name"] for col in _cached_columns(engine, table_name)]
         
         # 使用智能字段选择器
-        selector = SmartFieldSelector()
-        selected_fields = selector.select_relevant_fields(table_columns, question)
+        selected_fields, explanation = _select_fields(table_columns, question)
         
         # 如果选择的字段数量与总字段数量相同，说明没有优化空间
         if len(selected_fields) >= len(table_columns):
@@ -91,7 +137,7 @@ def _optimize_select_query(sql: str, question: str) -> tuple:
             "selected_fields_count": len(selected_fields),
             "selected_fields": selected_fields,
             "optimization_ratio": f"{(1 - len(selected_fields) / len(table_columns)) * 100:.1f}%",
-            "explanation": selector.explain_selection(table_columns, question, selected_fields)
+            "explanation": explanation
         }
         
         return optimized_sql, optimization_info
@@ -100,6 +146,9 @@ def _optimize_select_query(sql: str, question: str) -> tuple:
         # 如果优化过程出错，返回原始SQL
         return sql, None
 
+# 流式查询时每批从游标拉取的行数
+_STREAM_BATCH_SIZE = int(os.getenv("DB_STREAM_BATCH_SIZE", "1000"))
+
 # 全局数据库引擎
 _engine = None
 
@@ -107,10 +156,96 @@ def _get_engine():
     """获取数据库引擎"""
     global _engine
     if _engine is None:
+        from sqlalchemy import create_engine
         db_url = os.getenv("DATABASE_URL", "sqlite:///memory.db")
-        _engine = create_engine(db_url)
+        if db_url.startswith("sqlite"):
+            # SQLite使用SQLAlchemy默认的连接池策略
+            _engine = create_engine(db_url)
+        else:
+            # 服务端数据库使用显式调优的QueuePool：
+            # - 复用连接，避免每次工具调用重新建立连接
+            # - 关闭pool_pre_ping，省去每次借出连接时的探活往返
+            #   （在PgBouncer等连接代理前，pre_ping还会造成idle-in-transaction堆积），
+            #   改由pool_recycle定期回收连接来规避失效连接
+            _engine = create_engine(
+                db_url,
+                pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+                max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "5")),
+                pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "60")),
+                pool_pre_ping=False
+            )
     return _engine
 
+# 表结构反射缓存：{(engine_url, kind, table): (过期时间, 值)}
+# 反射（get_table_names/get_columns）每次都会访问数据库元数据，按TTL缓存后多次工具调用只需付一次代价
+_REFLECT_CACHE: Dict[Tuple[str, str, Optional[str]], Tuple[float, Any]] = {}
+_REFLECT_LOCK = threading.Lock()
+_REFLECT_TTL = float(os.getenv("DB_REFLECT_CACHE_TTL", "60"))
+
+def _reflect_cached(engine, kind: str, table: Optional[str], loader: Callable[[], Any]) -> Any:
+    """从反射缓存读取，未命中或过期时调用loader加载"""
+    key = (str(engine.url), kind, table)
+    now = time.monotonic()
+    with _REFLECT_LOCK:
+        entry = _REFLECT_CACHE.get(key)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+    value = loader()
+    with _REFLECT_LOCK:
+        _REFLECT_CACHE[key] = (now + _REFLECT_TTL, value)
+    return value
+
+def _cached_table_names(engine) -> List[str]:
+    """获取表名列表（带TTL缓存）"""
+    from sqlalchemy import inspect
+    return _reflect_cached(engine, "tables", None, lambda: inspect(engine).get_table_names())
+
+def _cached_table_name_set(engine) -> frozenset:
+    """获取表名集合（带TTL缓存），用于O(1)的存在性判断"""
+    return _reflect_cached(engine, "table_set", None, lambda: frozenset(_cached_table_names(engine)))
+
+def _ensure_reflected(engine) -> Dict[str, List[Dict[str, Any]]]:
+    """一次性批量反射所有表的列信息（带TTL缓存）
+    
+    使用SQLAlchemy 2.0的 Inspector.get_multi_columns()，
+    单次查询取回全部表的列，避免逐表调用get_columns()的N次往返。
+    """
+    def _load() -> Dict[str, List[Dict[str, Any]]]:
+        from sqlalchemy import inspect
+        multi = inspect(engine).get_multi_columns()
+        # get_multi_columns的键为 (schema, table_name)
+        return {table_name: columns for (_, table_name), columns in multi.items()}
+    return _reflect_cached(engine, "multi_columns", None, _load)
+
+def _cached_columns(engine, table: str) -> List[Dict[str, Any]]:
+    """获取表的列信息（优先使用批量反射结果）"""
+    columns = _ensure_reflected(engine).get(table)
+    if columns is not None:
+        return columns
+    # 批量结果中没有该表（如缓存期内新建的表），退回单表反射
+    from sqlalchemy import inspect
+    return _reflect_cached(engine, "columns", table, lambda: inspect(engine).get_columns(table))
+
+def invalidate(table: Optional[str] = None) -> None:
+    """使反射缓存失效（DDL变更后调用）
+    
+    Args:
+        table: 仅清除该表的列缓存；为None时清空全部缓存
+    """
+    with _REFLECT_LOCK:
+        if table is None:
+            _REFLECT_CACHE.clear()
+            return
+        # 表名列表与批量列信息都包含该表，需一并清除
+        for key in [k for k in _REFLECT_CACHE if k[2] == table or k[2] is None]:
+            del _REFLECT_CACHE[key]
+
+def _short_join(items: List[str], n: int = 5) -> str:
+    """用逗号连接前n项，超出部分以省略号表示（用于摘要文本）"""
+    if len(items) > n:
+        return f"{', '.join(items[:n])}..."
+    return ', '.join(items)
+
 def _format_success(data: Any) -> Dict[str, Any]:
     """格式化成功结果"""
     return {"ok": True, "data": data}
@@ -123,12 +258,11 @@ def list_tables() -> Dict[str, Any]:
     """列出数据库中的所有表"""
     try:
         engine = _get_engine()
-        inspector = inspect(engine)
-        tables = inspector.get_table_names()
+        tables = _cached_table_names(engine)
         return _format_success({
             "tables": tables,
             "count": len(tables),
-            "summary": f"发现 {len(tables)} 个表: {', '.join(tables[:5])}" + ("..." if len(tables) > 5 else "")
+            "summary": f"发现 {len(tables)} 个表: {_short_join(tables)}"
         })
     except Exception as e:
         return _format_error("DATABASE_ERROR", str(e))
@@ -141,14 +275,13 @@ def describe_table(table: str) -> Dict[str, Any]:
     """
     try:
         engine = _get_engine()
-        inspector = inspect(engine)
         
         # 检查表是否存在
-        if table not in inspector.get_table_names():
+        if table not in _cached_table_name_set(engine):
             return _format_error("TABLE_NOT_FOUND", f"表 '{table}' 不存在")
         
         # 获取列信息
-        columns = inspector.get_columns(table)
+        columns = _cached_columns(engine, table)
         column_info = []
         for col in columns:
             column_info.append({
@@ -162,45 +295,59 @@ def describe_table(table: str) -> Dict[str, Any]:
             "table": table,
             "columns": column_info,
             "column_count": len(column_info),
-            "summary": f"表 {table} 有 {len(column_info)} 个字段: {', '.join([c['name'] for c in column_info[:5]])}" + ("..." if len(column_info) > 5 else "")
+            "summary": f"表 {table} 有 {len(column_info)} 个字段: {_short_join([c['name'] for c in column_info])}"
         })
     except Exception as e:
         return _format_error("DATABASE_ERROR", str(e))
 
-def run_sql(sql: str, limit: int = 100, question: str = None) -> Dict[str, Any]:
+def run_sql(sql: str, limit: int = 100, question: str = None, columnar: bool = False) -> Dict[str, Any]:
     """执行SQL查询并返回结果
     
     Args:
         sql: 要执行的SQL语句
         limit: 返回结果的最大行数，默认100（减少上下文长度）
         question: 用户问题，用于智能优化SELECT查询的字段选择
+        columnar: 是否使用列式结果（columns + values二维数组），
+            避免为每行构造dict并重复输出列名，适合大结果集
     """
+    from sqlalchemy import text
+    from sqlalchemy.exc import ProgrammingError, OperationalError, NoSuchTableError
+    
     try:
-        # 安全检查
-        if not ensure_safe_sql(sql):
-            return _format_error("UNSAFE_SQL", "SQL语句包含潜在的不安全操作")
+        # 安全检查（按规范化SQL缓存，重试相同查询时无需重复检查）
+        unsafe_reason = _check_sql_safety(" ".join(sql.split()))
+        if unsafe_reason is not None:
+            return _format_error("UNSAFE_SQL", unsafe_reason)
         
         # 如果提供了问题且是SELECT查询，尝试智能优化字段选择
         optimized_sql = sql
         field_optimization_info = None
         
-        if question and sql.strip().upper().startswith('SELECT'):
+        is_select = sql.lstrip()[:6].upper() == 'SELECT'
+        if question and is_select:
             optimized_sql, field_optimization_info = _optimize_select_query(sql, question)
         
         engine = _get_engine()
         with engine.connect() as conn:
+            if is_select:
+                # 查询语句使用服务端游标分批拉取，逐行构造结果，
+                # 避免先fetchmany出完整Row列表再转换造成的双份内存占用
+                conn = conn.execution_options(stream_results=True, yield_per=max(1, min(limit, _STREAM_BATCH_SIZE)))
             result = conn.execute(text(optimized_sql))
             
             # 如果是查询语句，返回结果
             if result.returns_rows:
-                rows = result.fetchmany(limit)
                 columns = list(result.keys())
-                # 转换数据，处理datetime对象
-                data = [_convert_row_data(dict(zip(columns, row))) for row in rows]
+                # datetime等类型交由序列化阶段的default钩子处理，避免额外的递归遍历
+                if columnar:
+                    data = [tuple(row) for row in islice(result, limit)]
+                else:
+                    # RowMapping复用结果集预先计算好的键，无需每行重新zip列名
+                    data = [dict(row) for row in islice(result.mappings(), limit)]
                 
                 response_data = {
                     "columns": columns,
-                    "rows": data,
+                    "values" if columnar else "rows": data,
                     "row_count": len(data),
                     "summary": f"查询返回 {len(data)} 行数据" + (f"（限制 {limit} 行）" if len(data) == limit else "")
                 }
@@ -211,6 +358,8 @@ def run_sql(sql: str, limit: int = 100, question: str = None) -> Dict[str, Any]:
                     
                 return _format_success(response_data)
             else:
+                # 修改语句可能变更表结构，清空反射缓存
+                invalidate()
                 # 如果是修改语句，返回影响的行数
                 return _format_success({
                     "affected_rows": result.rowcount,
@@ -222,6 +371,15 @@ def run_sql(sql: str, limit: int = 100, question: str = None) -> Dict[str, Any]:
     except Exception as e:
         return _format_error("DATABASE_ERROR", str(e))
 
+def _select_rows(table: str, columns: List[str], limit: int):
+    """构造 SELECT columns FROM table LIMIT n 语句
+    
+    表名和列名由方言负责引用（quoting），LIMIT作为绑定参数，
+    相同表/列结构的语句可以复用SQLAlchemy的编译缓存和数据库端的执行计划。
+    """
+    from sqlalchemy import select, table as sql_table, column as sql_column
+    return select(*[sql_column(c) for c in columns]).select_from(sql_table(table)).limit(limit)
+
 def sample_rows(table: str, limit: int = 2, columns: str = None, question: str = None) -> Dict[str, Any]:
     """获取指定表的示例数据
     
@@ -233,44 +391,36 @@ def sample_rows(table: str, limit: int = 2, columns: str = None, question: str =
     """
     try:
         engine = _get_engine()
-        inspector = inspect(engine)
         
         # 检查表是否存在
-        if table not in inspector.get_table_names():
+        if table not in _cached_table_name_set(engine):
             return _format_error("TABLE_NOT_FOUND", f"表 '{table}' 不存在")
         
         # 获取表的所有列信息
-        table_columns = [col["name"] for col in inspector.get_columns(table)]
+        table_columns = [col["name"] for col in _cached_columns(engine, table)]
         
         # 构建SQL查询
         if columns:
             # 验证指定的列是否存在
             requested_columns = [col.strip() for col in columns.split(",")]
-            valid_columns = [col for col in requested_columns if col in table_columns]
+            table_column_set = frozenset(table_columns)
+            valid_columns = [col for col in requested_columns if col in table_column_set]
             
             if not valid_columns:
                 return _format_error("INVALID_COLUMNS", f"指定的列 '{columns}' 在表 '{table}' 中不存在")
             
-            columns_str = ", ".join(valid_columns)
-            sql = f"SELECT {columns_str} FROM {table} LIMIT {limit}"
+            stmt = _select_rows(table, valid_columns, limit)
         elif question:
-            # 使用智能字段选择
-            selector = SmartFieldSelector()
-            selected_fields = selector.select_relevant_fields(table_columns, question)
-            columns_str = ", ".join(selected_fields)
-            sql = f"SELECT {columns_str} FROM {table} LIMIT {limit}"
-            
-            # 添加字段选择说明
-            explanation = selector.explain_selection(table_columns, question, selected_fields)
+            # 使用智能字段选择（同时得到字段选择说明）
+            selected_fields, explanation = _select_fields(table_columns, question)
+            stmt = _select_rows(table, selected_fields, limit)
         else:
-            sql = f"SELECT * FROM {table} LIMIT {limit}"
+            stmt = _select_rows(table, table_columns, limit)
         
         with engine.connect() as conn:
-            result = conn.execute(text(sql))
-            rows = result.fetchall()
+            result = conn.execute(stmt)
             columns_list = list(result.keys())
-            # 转换数据，处理datetime对象
-            data = [_convert_row_data(dict(zip(columns_list, row))) for row in rows]
+            data = [dict(row) for row in result.mappings()]
             
         response_data = {
             "table": table,
@@ -290,13 +440,119 @@ def sample_rows(table: str, limit: int = 2, columns: str = None, question: str =
         return _format_error("DATABASE_ERROR", str(e))
 
 
+# 批量描述表结构时的最大并发数
+_DESCRIBE_MAX_WORKERS = int(os.getenv("DB_DESCRIBE_MAX_WORKERS", "8"))
+
+def describe_tables(tables: List[str]) -> Dict[str, Any]:
+    """批量获取多个表的结构信息
+    
+    先统一预热反射缓存（一次批量反射），再用线程池并发描述各表；
+    批量结果未覆盖的表会回退到单表反射，这些数据库往返可以并行进行。
+    
+    Args:
+        tables: 表名列表，也可以是逗号分隔的字符串
+    """
+    if isinstance(tables, str):
+        tables = tables.split(",")
+    # 去除空白与重复表名，保持原有顺序
+    tables = list(dict.fromkeys(t.strip() for t in tables if t and t.strip()))
+    if not tables:
+        return _format_error("INVALID_ARGUMENT", "未指定要描述的表")
+    
+    try:
+        engine = _get_engine()
+        # 预热缓存，避免多个线程同时触发同一次批量反射
+        _cached_table_name_set(engine)
+        _ensure_reflected(engine)
+        
+        with ThreadPoolExecutor(max_workers=min(_DESCRIBE_MAX_WORKERS, len(tables))) as executor:
+            results = list(executor.map(describe_table, tables))
+    except Exception as e:
+        return _format_error("DATABASE_ERROR", str(e))
+    
+    described = [result["data"] for result in results if result["ok"]]
+    errors = [
+        {"table": table, **result["error"]}
+        for table, result in zip(tables, results) if not result["ok"]
+    ]
+    return _format_success({
+        "tables": described,
+        "errors": errors,
+        "count": len(described),
+        "summary": f"已获取 {len(described)} 个表的结构" + (f"，{len(errors)} 个表失败" if errors else "")
+    })
+
+# 目录估算行数低于该阈值时改用精确COUNT（小表全表计数代价可忽略）
+_EXACT_COUNT_THRESHOLD = int(os.getenv("DB_STATS_EXACT_THRESHOLD", "100000"))
+
+def _estimate_row_count(conn, dialect: str, table: str) -> Optional[int]:
+    """从数据库系统目录读取表行数估算值，无法获取时返回None"""
+    from sqlalchemy import text
+    
+    if dialect == "postgresql":
+        # reltuples 由 ANALYZE/autovacuum 维护；从未分析过的表为 -1（PG14+）或 0
+        estimate = conn.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = :t"), {"t": table}
+        ).scalar()
+    elif dialect in ("mysql", "mariadb"):
+        estimate = conn.execute(
+            text("SELECT table_rows FROM information_schema.tables "
+                 "WHERE table_schema = DATABASE() AND table_name = :t"), {"t": table}
+        ).scalar()
+    else:
+        # SQLite等没有可靠的目录估算，直接计数
+        return None
+    
+    if estimate is None or estimate <= 0:
+        return None
+    return int(estimate)
+
+def get_table_stats(table: str) -> Dict[str, Any]:
+    """获取指定表的统计信息（行数、字段数）
+    
+    大表的行数取自系统目录估算值（PostgreSQL的pg_class.reltuples、
+    MySQL的information_schema.tables.TABLE_ROWS），避免 COUNT(*) 全表扫描；
+    小表或无法估算时执行精确计数。
+    
+    Args:
+        table: 表名
+    """
+    try:
+        from sqlalchemy import select, func, table as sql_table
+        
+        engine = _get_engine()
+        
+        # 检查表是否存在
+        if table not in _cached_table_name_set(engine):
+            return _format_error("TABLE_NOT_FOUND", f"表 '{table}' 不存在")
+        
+        with engine.connect() as conn:
+            row_count = _estimate_row_count(conn, engine.dialect.name, table)
+            approximate = row_count is not None and row_count >= _EXACT_COUNT_THRESHOLD
+            if not approximate:
+                row_count = conn.execute(select(func.count()).select_from(sql_table(table))).scalar()
+        
+        column_count = len(_cached_columns(engine, table))
+        return _format_success({
+            "table": table,
+            "row_count": row_count,
+            "approximate": approximate,
+            "column_count": column_count,
+            "summary": f"表 {table} 共 {'约 ' if approximate else ''}{row_count} 行，{column_count} 个字段"
+        })
+    except Exception as e:
+        return _format_error("DATABASE_ERROR", str(e))
+
+
 def list_available_tools() -> Dict[str, Any]:
     """列出所有可用的数据库工具"""
     tools = [
         "list_tables - 列出所有表",
         "describe_table - 描述表结构",
+        "describe_tables - 批量描述多个表的结构",
         "sample_rows - 查看表样本数据",
-        "run_sql - 执行SQL查询"
+        "run_sql - 执行SQL查询",
+        "get_table_stats - 查看表统计信息（行数、字段数）"
     ]
     
     return _format_success({
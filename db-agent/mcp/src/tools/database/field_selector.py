@@ -1,9 +1,21 @@
 """智能字段选择器 - 根据问题内容智能选择相关字段"""
 
+import copy
+import heapq
 import re
-from typing import List, Dict, Set, Tuple
+from functools import lru_cache
+from typing import List, Dict, Set, Tuple, Optional
 from dataclasses import dataclass
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+# 分词模式
+_WORD_RE = re.compile(r'\w+')
+
 
 @dataclass
 class FieldRelevance:
@@ -56,19 +68,112 @@ class SmartFieldSelector:
             "数据|信息|记录": ["data", "info", "record", "log", "history"],
         }
         
+        # 预编译关键词模式，评分时无需每次经过re模块的编译缓存查找
+        self._compiled_mappings = [
+            (re.compile(pattern), pattern, related_fields)
+            for pattern, related_fields in self.keyword_mappings.items()
+        ]
+        self._automaton = self._build_keyword_automaton()
+        
+        # 倒排索引：相关字段词（小写） -> 引用它的规则序号集合
+        self._related_to_rules: Dict[str, Set[int]] = {}
+        for rule_id, related_fields in enumerate(self.keyword_mappings.values()):
+            for related_field in related_fields:
+                self._related_to_rules.setdefault(related_field.lower(), set()).add(rule_id)
+        # 字段名（小写） -> 相关规则序号集合
+        self._field_rules_cache: Dict[str, frozenset] = {}
+        
+        # 字段侧特征只与字段列表有关，同一张表重复提问时直接复用
+        self._field_features = lru_cache(maxsize=256)(self._compute_field_features)
+        # 最近一次评分结果：(问题, 字段元组, 评分列表)
+        self._last_scores: Optional[Tuple[str, Tuple[str, ...], List[FieldRelevance]]] = None
+        
         # 常见无关字段（通常不需要在查询结果中显示）
         # 注意：不包含ID和时间字段，因为这些通常是重要的
-        self.irrelevant_fields = {
+        self.irrelevant_fields = frozenset({
             "metadata", "raw_data", "hash", "checksum",
             "blob", "binary_data", "large_text", "description_long",
             "config", "settings", "preferences", "cache"
-        }
+        })
         
         # 核心字段（通常应该包含）
-        self.core_fields = {
+        self.core_fields = frozenset({
             "id", "name", "title", "status", "type", "created_at", "updated_at", 
             "create_time", "update_time", "time", "date", "timestamp"
-        }
+        })
+    
+    def _build_keyword_automaton(self):
+        """将所有关键词构建为Aho-Corasick自动机（未安装pyahocorasick时返回None）
+        
+        关键词模式都是字面量的"|"并集，一次自动机扫描即可找出问题命中的全部规则，
+        耗时只与问题长度相关，不随规则数量增长。
+        """
+        if ahocorasick is None:
+            return None
+        
+        # 同一关键词可能出现在多条规则中（如"状态"），按关键词汇总规则序号
+        keyword_rules: Dict[str, Set[int]] = {}
+        for rule_id, pattern in enumerate(self.keyword_mappings):
+            for keyword in pattern.split("|"):
+                keyword_rules.setdefault(keyword, set()).add(rule_id)
+        
+        automaton = ahocorasick.Automaton()
+        for keyword, rule_ids in keyword_rules.items():
+            automaton.add_word(keyword, frozenset(rule_ids))
+        automaton.make_automaton()
+        return automaton
+    
+    def _compute_field_features(self, fields: Tuple[str, ...]) -> Tuple[Tuple[str, str, Tuple[str, ...], bool, bool], ...]:
+        """计算字段列表中与问题无关的特征
+        
+        Returns:
+            每个字段的 (字段名, 小写字段名, 去重后的字段分词, 是否核心字段, 是否无关字段)
+        """
+        features = []
+        for field in fields:
+            field_lower = field.lower()
+            features.append((
+                field,
+                field_lower,
+                tuple(dict.fromkeys(_WORD_RE.findall(field_lower))),
+                field_lower in self.core_fields,
+                field_lower in self.irrelevant_fields
+            ))
+        return tuple(features)
+    
+    def _match_keyword_rules(self, question_lower: str) -> List[Tuple[int, str]]:
+        """找出问题命中的关键词规则，按规则定义顺序返回 (规则序号, 模式)"""
+        if self._automaton is None:
+            return [
+                (rule_id, pattern)
+                for rule_id, (compiled_pattern, pattern, _) in enumerate(self._compiled_mappings)
+                if compiled_pattern.search(question_lower)
+            ]
+        
+        hit_rule_ids: Set[int] = set()
+        for _, rule_ids in self._automaton.iter(question_lower):
+            hit_rule_ids.update(rule_ids)
+        return [
+            (rule_id, pattern)
+            for rule_id, (_, pattern, _) in enumerate(self._compiled_mappings)
+            if rule_id in hit_rule_ids
+        ]
+    
+    def _rules_for_field(self, field_lower: str) -> frozenset:
+        """获取与字段名相关的关键词规则序号集合（按字段名缓存）
+        
+        字段与规则相关的条件是：规则的某个相关字段词是字段名的子串，或字段名是它的子串。
+        每个字段名只需对去重后的相关字段词扫描一次，之后评分时是O(1)的集合查询。
+        """
+        rule_ids = self._field_rules_cache.get(field_lower)
+        if rule_ids is None:
+            hits: Set[int] = set()
+            for related_lower, related_rule_ids in self._related_to_rules.items():
+                if related_lower in field_lower or field_lower in related_lower:
+                    hits.update(related_rule_ids)
+            rule_ids = frozenset(hits)
+            self._field_rules_cache[field_lower] = rule_ids
+        return rule_ids
     
     def select_relevant_fields(self, question: str, available_fields: List[str], 
                              max_fields: int = 8) -> List[str]:
@@ -89,25 +194,15 @@ class SmartFieldSelector:
         # 计算每个字段的相关性评分
         field_scores = self._calculate_field_relevance(question, available_fields)
         
-        # 按评分排序
-        sorted_fields = sorted(field_scores, key=lambda x: x.score, reverse=True)
-        
-        # 选择最相关的字段
-        selected_fields = []
-        
-        # 首先添加核心字段（如果存在且相关）
-        for field_info in sorted_fields:
-            if field_info.field_name.lower() in self.core_fields and field_info.score > 0:
-                selected_fields.append(field_info.field_name)
-                if len(selected_fields) >= max_fields:
-                    break
-        
-        # 然后添加其他高分字段
-        for field_info in sorted_fields:
-            if (field_info.field_name not in selected_fields and 
-                field_info.score > 0 and 
-                len(selected_fields) < max_fields):
-                selected_fields.append(field_info.field_name)
+        # 选择最相关的字段：核心字段优先，其次按评分从高到低（同分保持原字段顺序）
+        # 只需前max_fields个，用堆取Top-K代替全量排序
+        core_fields = self.core_fields
+        top_fields = heapq.nlargest(
+            max_fields,
+            (field_info for field_info in field_scores if field_info.score > 0),
+            key=lambda x: (x.field_name.lower() in core_fields, x.score)
+        )
+        selected_fields = [field_info.field_name for field_info in top_fields]
         
         # 如果没有找到相关字段，返回前几个核心字段
         if not selected_fields:
@@ -124,22 +219,39 @@ class SmartFieldSelector:
         return selected_fields[:max_fields]
     
     def _calculate_field_relevance(self, question: str, available_fields: List[str]) -> List[FieldRelevance]:
-        """计算字段相关性评分"""
+        """计算字段相关性评分
+        
+        最近一次的评分结果会被保留：select_relevant_fields 之后紧接着调用
+        explain_selection 时（参数相同）直接复用，不再重复打分。
+        """
+        fields_key = tuple(available_fields)
+        last_scores = self._last_scores
+        if last_scores is not None and last_scores[0] == question and last_scores[1] == fields_key:
+            return last_scores[2]
+        
         field_scores = []
         question_lower = question.lower()
         
-        for field in available_fields:
+        # 只依赖问题的计算提到循环外：命中的关键词规则和问题分词
+        matched_rules = self._match_keyword_rules(question_lower)
+        question_words = set(_WORD_RE.findall(question_lower))
+        
+        for field, field_lower, field_tokens, is_core, is_irrelevant in self._field_features(fields_key):
+            # 无关字段且问题中未直接提到：直接判为无关，跳过后续关键词和分词匹配
+            if is_irrelevant and field_lower not in question_lower:
+                field_scores.append(FieldRelevance(field, -2.0, ["常见无关字段"]))
+                continue
+            
             score = 0.0
             reasons = []
-            field_lower = field.lower()
             
             # 检查是否为无关字段
-            if field_lower in self.irrelevant_fields:
+            if is_irrelevant:
                 score -= 2.0
                 reasons.append("常见无关字段")
             
             # 检查是否为核心字段
-            if field_lower in self.core_fields:
+            if is_core:
                 score += 1.0
                 reasons.append("核心字段")
             
@@ -149,24 +261,22 @@ class SmartFieldSelector:
                 reasons.append("字段名直接匹配")
             
             # 关键词映射匹配
-            for pattern, related_fields in self.keyword_mappings.items():
-                if re.search(pattern, question_lower):
-                    for related_field in related_fields:
-                        if related_field.lower() in field_lower or field_lower in related_field.lower():
-                            score += 2.0
-                            reasons.append(f"关键词匹配: {pattern}")
-                            break
+            if matched_rules:
+                field_rules = self._rules_for_field(field_lower)
+                for rule_id, pattern in matched_rules:
+                    if rule_id in field_rules:
+                        score += 2.0
+                        reasons.append(f"关键词匹配: {pattern}")
             
-            # 部分匹配
-            question_words = set(re.findall(r'\w+', question_lower))
-            field_words = set(re.findall(r'\w+', field_lower))
-            common_words = question_words.intersection(field_words)
-            if common_words:
-                score += len(common_words) * 0.5
-                reasons.append(f"部分词汇匹配: {common_words}")
+            # 部分匹配（字段通常只有1~3个词，直接计数，命中时才构造集合用于说明）
+            hit_count = sum(1 for token in field_tokens if token in question_words)
+            if hit_count:
+                score += hit_count * 0.5
+                reasons.append(f"部分词汇匹配: {question_words.intersection(field_tokens)}")
             
             field_scores.append(FieldRelevance(field, score, reasons))
         
+        self._last_scores = (question, fields_key, field_scores)
         return field_scores
     
     def explain_selection(self, question: str, available_fields: List[str], 
@@ -193,6 +303,34 @@ class SmartFieldSelector:
         return explanation
 
 
+# 全局共用的选择器实例（无状态，首次使用时创建）
+_DEFAULT_SELECTOR: Optional[SmartFieldSelector] = None
+
+
+def get_default_selector() -> SmartFieldSelector:
+    """获取全局共用的字段选择器实例"""
+    global _DEFAULT_SELECTOR
+    if _DEFAULT_SELECTOR is None:
+        _DEFAULT_SELECTOR = SmartFieldSelector()
+    return _DEFAULT_SELECTOR
+
+
+@lru_cache(maxsize=1024)
+def _cached_selection(question: str, available_fields: Tuple[str, ...],
+                      max_fields: int) -> Tuple[Tuple[str, ...], Dict[str, any]]:
+    """按 (问题, 字段, 最大字段数) 缓存选择结果及说明"""
+    selector = get_default_selector()
+    fields = list(available_fields)
+    selected_fields = selector.select_relevant_fields(question, fields, max_fields)
+    explanation = selector.explain_selection(question, fields, selected_fields)
+    return tuple(selected_fields), explanation
+
+
+def clear_selection_cache() -> None:
+    """清空便捷函数的结果缓存（测试或修改映射规则后使用）"""
+    _cached_selection.cache_clear()
+
+
 def create_smart_columns_parameter(question: str, available_fields: List[str], 
                                  max_fields: int = 8) -> str:
     """
@@ -206,8 +344,7 @@ def create_smart_columns_parameter(question: str, available_fields: List[str],
     Returns:
         逗号分隔的字段名字符串
     """
-    selector = SmartFieldSelector()
-    selected_fields = selector.select_relevant_fields(question, available_fields, max_fields)
+    selected_fields, _ = _cached_selection(question, tuple(available_fields), max_fields)
     return ",".join(selected_fields)
 
 
@@ -220,7 +357,6 @@ def smart_field_selection(question: str, available_fields: List[str],
     Returns:
         (selected_fields, explanation)
     """
-    selector = SmartFieldSelector()
-    selected_fields = selector.select_relevant_fields(question, available_fields, max_fields)
-    explanation = selector.explain_selection(question, available_fields, selected_fields)
-    return selected_fields, explanation
\ No newline at end of file
+    selected_fields, explanation = _cached_selection(question, tuple(available_fields), max_fields)
+    # 说明字典为缓存共享对象，返回副本避免调用方修改缓存
+    return list(selected_fields), copy.deepcopy(explanation)
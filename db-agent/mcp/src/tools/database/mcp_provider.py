@@ -1,16 +1,48 @@
 """数据库工具的MCP提供者 - 统一的MCP架构实现"""
 
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 from ...core.mcp_tool_registry import BaseMCPToolProvider, MCPToolInfo, ToolCategory
-from .database_tools import list_tables, describe_table, run_sql, sample_rows
-import json
+from .database_tools import list_tables, describe_table, describe_tables, run_sql, sample_rows, get_table_stats, _serialize_datetime
+import os
+import time
+import orjson
+
+# 工具结果由程序读取，默认输出紧凑JSON；
+# 设置 MCP_PRETTY_JSON=1（全部工具）或 MCP_DB_PRETTY_JSON=1（仅数据库工具）可输出缩进格式便于调试
+_DUMPS_OPTION = orjson.OPT_NON_STR_KEYS
+if any(os.getenv(name, "").lower() in ("1", "true", "yes") for name in ("MCP_DB_PRETTY_JSON", "MCP_PRETTY_JSON")):
+    _DUMPS_OPTION |= orjson.OPT_INDENT_2
+
+
+# get_domain_context 中表列表的缓存时间（秒），每轮推理都会获取上下文，无需每次查询数据库
+_TABLES_CACHE_TTL = 30.0
+
+
+def _dumps(result: Dict[str, Any]) -> str:
+    """序列化工具结果（orjson C实现，datetime等类型通过default钩子处理）"""
+    return orjson.dumps(result, default=_serialize_datetime, option=_DUMPS_OPTION).decode()
 
 
 class DatabaseMCPProvider(BaseMCPToolProvider):
     """数据库工具的MCP提供者"""
     
+    __slots__ = ("db_path", "_tables_cache")
+    
     def __init__(self, db_path: str = None):
         self.db_path = db_path
+        # list_tables结果缓存：(过期时间, 结果)
+        self._tables_cache: Optional[Tuple[float, Dict[str, Any]]] = None
+    
+    def _get_tables_cached(self, ttl: float = _TABLES_CACHE_TTL) -> Dict[str, Any]:
+        """获取list_tables结果，在ttl秒内复用上次的成功结果"""
+        now = time.monotonic()
+        cached = self._tables_cache
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        result = list_tables()
+        if result.get("ok"):
+            self._tables_cache = (now + ttl, result)
+        return result
     
     def get_category(self) -> str:
         """获取工具类别"""
@@ -40,6 +72,19 @@ class DatabaseMCPProvider(BaseMCPToolProvider):
                 handler=self._describe_table_wrapper,
                 is_async=False
             ),
+            MCPToolInfo(
+                name="describe_tables",
+                description="批量获取多个表的结构信息（并发查询，适合一次了解多个表）",
+                category=self.get_category(),
+                parameters={
+                    "tables": {
+                        "type": "string",
+                        "description": "表名列表，用逗号分隔，如 'users,orders'"
+                    }
+                },
+                handler=self._describe_tables_wrapper,
+                is_async=False
+            ),
             MCPToolInfo(
                 name="run_sql",
                 description="执行SQL查询并返回结果",
@@ -53,6 +98,11 @@ class DatabaseMCPProvider(BaseMCPToolProvider):
                         "type": "integer",
                         "description": "返回结果的最大行数，默认100",
                         "default": 100
+                    },
+                    "columnar": {
+                        "type": "boolean",
+                        "description": "是否以列式格式返回（columns + values），大结果集更紧凑，默认false",
+                        "default": False
                     }
                 },
                 handler=self._run_sql_wrapper,
@@ -80,6 +130,19 @@ class DatabaseMCPProvider(BaseMCPToolProvider):
                 },
                 handler=self._sample_rows_wrapper,
                 is_async=False
+            ),
+            MCPToolInfo(
+                name="get_table_stats",
+                description="获取指定表的统计信息（行数、字段数），大表行数为系统目录估算值",
+                category=self.get_category(),
+                parameters={
+                    "table": {
+                        "type": "string",
+                        "description": "表名"
+                    }
+                },
+                handler=self._table_stats_wrapper,
+                is_async=False
             )
         ]
     
@@ -90,8 +153,10 @@ class DatabaseMCPProvider(BaseMCPToolProvider):
 
 1. list_tables: 列出所有表
 2. describe_table: 查看表结构
-3. run_sql: 执行SQL查询
-4. sample_rows: 获取表的示例数据
+3. describe_tables: 批量查看多个表的结构
+4. run_sql: 执行SQL查询
+5. sample_rows: 获取表的示例数据
+6. get_table_stats: 查看表的行数和字段数
 
 使用建议：
 - 先用 list_tables 了解数据库结构
@@ -108,7 +173,7 @@ class DatabaseMCPProvider(BaseMCPToolProvider):
         
         # 尝试获取当前数据库的基本信息
         try:
-            tables_result = list_tables()
+            tables_result = self._get_tables_cached()
             if tables_result.get("ok"):
                 tables = tables_result["data"]["tables"]
                 context.append({
@@ -125,49 +190,73 @@ class DatabaseMCPProvider(BaseMCPToolProvider):
         """列出数据库中的所有表"""
         try:
             result = list_tables()
-            return json.dumps(result, ensure_ascii=False, indent=2)
+            return _dumps(result)
         except Exception as e:
             error_result = {
                 "ok": False,
                 "error": {"code": "DATABASE_ERROR", "message": str(e)}
             }
-            return json.dumps(error_result, ensure_ascii=False, indent=2)
+            return _dumps(error_result)
     
     def _describe_table_wrapper(self, table: str) -> str:
         """获取指定表的结构信息"""
         try:
             result = describe_table(table)
-            return json.dumps(result, ensure_ascii=False, indent=2)
+            return _dumps(result)
+        except Exception as e:
+            error_result = {
+                "ok": False,
+                "error": {"code": "DATABASE_ERROR", "message": str(e)}
+            }
+            return _dumps(error_result)
+    
+    def _describe_tables_wrapper(self, tables: str) -> str:
+        """批量获取多个表的结构信息"""
+        try:
+            result = describe_tables(tables)
+            return _dumps(result)
         except Exception as e:
             error_result = {
                 "ok": False,
                 "error": {"code": "DATABASE_ERROR", "message": str(e)}
             }
-            return json.dumps(error_result, ensure_ascii=False, indent=2)
+            return _dumps(error_result)
     
-    def _run_sql_wrapper(self, sql: str, limit: int = 100) -> str:
+    def _run_sql_wrapper(self, sql: str, limit: int = 100, columnar: bool = False) -> str:
         """执行SQL查询并返回结果"""
         try:
-            result = run_sql(sql, limit)
-            return json.dumps(result, ensure_ascii=False, indent=2)
+            result = run_sql(sql, limit, columnar=columnar)
+            return _dumps(result)
         except Exception as e:
             error_result = {
                 "ok": False,
                 "error": {"code": "DATABASE_ERROR", "message": str(e)}
             }
-            return json.dumps(error_result, ensure_ascii=False, indent=2)
+            return _dumps(error_result)
     
     def _sample_rows_wrapper(self, table: str, limit: int = 2, columns: str = None) -> str:
         """获取指定表的示例数据"""
         try:
             result = sample_rows(table, limit, columns)
-            return json.dumps(result, ensure_ascii=False, indent=2)
+            return _dumps(result)
+        except Exception as e:
+            error_result = {
+                "ok": False,
+                "error": {"code": "DATABASE_ERROR", "message": str(e)}
+            }
+            return _dumps(error_result)
+    
+    def _table_stats_wrapper(self, table: str) -> str:
+        """获取指定表的统计信息"""
+        try:
+            result = get_table_stats(table)
+            return _dumps(result)
         except Exception as e:
             error_result = {
                 "ok": False,
                 "error": {"code": "DATABASE_ERROR", "message": str(e)}
             }
-            return json.dumps(error_result, ensure_ascii=False, indent=2)
+            return _dumps(error_result)
 
 
 def register_database_mcp_tools(registry, db_path: str = None):
@@ -0,0 +1,42 @@
+"""对话列表过滤条件测试"""
+
+import pytest
+
+pytest.importorskip("mcp")
+
+from mcp.server.fastmcp import FastMCP
+
+from src.core.conversation_manager import ConversationManager, ConversationMetadata
+from src.core.mcp_tool_registry import MCPToolRegistry
+from src.core.schemas import AgentState
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = ConversationManager(MCPToolRegistry(FastMCP("test")), db_path=str(tmp_path / "conversations.db"))
+    for thread_id, title, categories in [
+        ("t1", "销量_汇总", ["database"]),
+        ("t2", "销量汇总", ["database_admin"]),
+        ("t3", "完成率100%", []),
+    ]:
+        manager.save_conversation(
+            ConversationMetadata(thread_id=thread_id, title=title, tool_categories=categories),
+            AgentState(question=title),
+        )
+    return manager
+
+
+def _titles(manager, **filters):
+    return sorted(c["title"] for c in manager.list_conversations(**filters))
+
+
+def test_short_search_matches_wildcards_literally(manager):
+    assert _titles(manager, search="_") == ["销量_汇总"]
+    assert _titles(manager, search="%") == ["完成率100%"]
+    assert manager.count_conversations(search="_") == 1
+
+
+def test_tool_category_matches_exactly(manager):
+    assert _titles(manager, tool_category="database") == ["销量_汇总"]
+    assert _titles(manager, tool_category="data%") == []
+    assert manager.count_conversations(tool_category="database_admin") == 1
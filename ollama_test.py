@@ -6,15 +6,24 @@ Ollama服务器连接测试工具
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError
+from urllib3.util.retry import Retry
 import json
 import time
 import sys
 import socket
-import subprocess
-import platform
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+from typing import Dict, Final, List, Optional, Tuple
 import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，缺失时回退到标准库json
+    orjson = None
 
 # 连接配置
 LLM_BINDING = "ollama"
@@ -23,34 +32,88 @@ LLM_BINDING_HOST = "http://121.195.154.220"
 OLLAMA_PORT = 80
 OLLAMA_URL = f"{LLM_BINDING_HOST}:{OLLAMA_PORT}"
 
+# 并发测试配置：最大并发请求数及相邻请求的最小发起间隔（秒）
+MAX_CONCURRENT_TESTS = 5
+MIN_REQUEST_INTERVAL = 0.2
+
+# 复杂测试问题（类别, 问题），模块加载时创建一次
+TEST_QUESTIONS: Final[Tuple[Tuple[str, str], ...]] = (
+    ("逻辑推理", 
+     """有一个古老的逻辑谜题：在一个小镇上，有一位理发师，他只给那些不给自己理发的人理发。
+             请分析这个悖论的逻辑结构，解释为什么这是一个自相矛盾的陈述，并提出至少三种可能的解决方案。
+             同时，请将这个问题与罗素悖论进行比较，说明它们在数学逻辑中的意义。"""),
+
+    ("创意写作", 
+     """请创作一个科幻短故事（500-800字），故事背景设定在2080年，人类已经实现了意识上传技术。
+             主角是一名数据考古学家，专门研究被遗忘的数字文明遗迹。故事要包含以下元素：
+             1. 一个关于人工智能觉醒的秘密
+             2. 时间悖论的概念
+             3. 对人性本质的深度思考
+             请确保故事有完整的情节结构和深刻的哲学内涵。"""),
+
+    ("数据分析", 
+     """假设你是一名数据科学家，需要分析一个电商平台的用户行为数据。给定以下信息：
+             - 平台有100万活跃用户
+             - 平均每用户每月访问15次
+             - 转化率为3.2%
+             - 平均订单价值为156元
+             - 用户留存率：1个月85%，3个月62%，12个月34%
+             
+             请设计一个完整的分析框架来：
+             1. 识别高价值用户群体
+             2. 预测用户流失风险
+             3. 制定个性化营销策略
+             4. 估算不同策略的ROI
+             并解释你的分析方法和预期结果。"""),
+
+    ("技术架构", 
+     """设计一个支持千万级用户的实时聊天系统架构。系统需要满足以下要求：
+             1. 支持文本、图片、语音、视频消息
+             2. 消息送达率99.9%以上
+             3. 消息延迟小于100ms
+             4. 支持群聊（最多1000人）
+             5. 消息加密和隐私保护
+             6. 跨平台兼容（Web、iOS、Android）
+             
+             请详细说明：
+             - 整体架构设计（包括微服务拆分）
+             - 数据库设计和分片策略
+             - 消息队列和实时通信方案
+             - 负载均衡和容灾机制
+             - 安全和隐私保护措施
+             - 性能优化策略"""),
+
+    ("哲学思辨", 
+     """探讨人工智能时代的伦理问题：当AI系统的决策能力超越人类时，我们应该如何定义责任和道德？
+             
+             请从以下角度进行深入分析：
+             1. 道德主体性：AI是否可以成为道德主体？
+             2. 责任归属：AI造成的伤害应该由谁承担责任？
+             3. 决策透明度：AI的"黑盒"决策是否违背了道德原则？
+             4. 人类尊严：AI的超越是否威胁到人类的内在价值？
+             5. 未来社会：在AI主导的社会中，人类的角色是什么？
+             
+             请结合具体案例，提出你的观点和解决方案，并考虑不同文化背景下的伦理差异。""")
+)
+
 class NetworkDiagnostics:
     """网络诊断工具"""
     
     @staticmethod
-    def ping_host(host: str, timeout: int = 5) -> Tuple[bool, str, float]:
-        """Ping测试主机连通性"""
+    def ping_host(host: str, port: int = 80, timeout: int = 5) -> Tuple[bool, str, float]:
+        """通过TCP连接探测主机连通性（无需ICMP权限，也不启动ping子进程）"""
+        start_time = time.perf_counter()
         try:
-            # 根据操作系统选择ping命令
-            if platform.system().lower() == "windows":
-                cmd = ["ping", "-n", "1", "-w", str(timeout * 1000), host]
-            else:
-                cmd = ["ping", "-c", "1", "-W", str(timeout), host]
-            
-            start_time = time.time()
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout + 2)
-            end_time = time.time()
-            
-            ping_time = (end_time - start_time) * 1000  # 转换为毫秒
-            
-            if result.returncode == 0:
-                return True, "Ping成功", ping_time
-            else:
-                return False, f"Ping失败: {result.stderr.strip()}", ping_time
-                
-        except subprocess.TimeoutExpired:
-            return False, f"Ping超时 (>{timeout}秒)", timeout * 1000
-        except Exception as e:
-            return False, f"Ping错误: {str(e)}", 0
+            with socket.create_connection((host, port), timeout=timeout):
+                pass
+            return True, "主机可达 (TCP连接成功)", (time.perf_counter() - start_time) * 1000
+        except ConnectionRefusedError:
+            # 收到RST说明主机在线，只是端口未开放
+            return True, "主机可达 (端口拒绝连接)", (time.perf_counter() - start_time) * 1000
+        except socket.timeout:
+            return False, f"主机探测超时 (>{timeout}秒)", timeout * 1000
+        except OSError as e:
+            return False, f"主机不可达: {str(e)}", (time.perf_counter() - start_time) * 1000
     
     @staticmethod
     def check_port(host: str, port: int, timeout: int = 5) -> Tuple[bool, str, float]:
@@ -87,7 +150,7 @@ class NetworkDiagnostics:
                 "  • 确认服务器IP地址是否正确",
                 "  • 检查网络连接是否正常",
                 "  • 确认服务器是否在线",
-                "  • 检查防火墙是否阻止了ICMP包",
+                "  • 检查防火墙是否拦截了TCP连接",
                 "  • 尝试使用其他网络或VPN连接"
             ])
         elif not port_open:
@@ -122,16 +185,34 @@ class NetworkDiagnostics:
 class OllamaTestClient:
     """Ollama测试客户端"""
     
+    # 每次请求的连接/读取超时（秒）；流式模式下读取超时为相邻数据块之间的最长等待
+    CONNECT_TIMEOUT = 3.0
+    READ_TIMEOUT = 120.0
+    
     def __init__(self, base_url: str, model: str):
         self.base_url = base_url
         self.model = model
         self.session = requests.Session()
-        self.session.timeout = 30
+        self.timeout = (self.CONNECT_TIMEOUT, self.READ_TIMEOUT)
+        
+        # 复用keep-alive连接；仅对幂等的GET在429/5xx时按指数退避重试（遵循Retry-After），
+        # POST /api/generate 不重试，避免重复生成并把重试耗时计入响应时间
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json", "Connection": "keep-alive"})
         
     def check_connection(self) -> Tuple[bool, str]:
         """检查Ollama服务器连接状态"""
         try:
-            response = self.session.get(f"{self.base_url}/api/tags")
+            response = self.session.get(f"{self.base_url}/api/tags", timeout=self.timeout)
             if response.status_code == 200:
                 models = response.json().get('models', [])
                 model_names = [m.get('name', '') for m in models]
@@ -144,8 +225,8 @@ class OllamaTestClient:
         except requests.exceptions.RequestException as e:
             return False, f"连接失败: {str(e)}"
     
-    def generate_response(self, prompt: str, stream: bool = False) -> Tuple[Optional[str], float, Dict]:
-        """生成响应并测量性能"""
+    def generate_response(self, prompt: str, stream: bool = True) -> Tuple[Optional[str], float, Dict]:
+        """生成响应并测量性能（流式模式下同时记录首token延迟）"""
         start_time = time.time()
         
         payload = {
@@ -160,54 +241,100 @@ class OllamaTestClient:
         }
         
         try:
-            response = self.session.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                headers={"Content-Type": "application/json"}
-            )
+            with self.session.post(
+                f"{self.base_url}/api/generate", json=payload, stream=stream, timeout=self.timeout
+            ) as response:
+                if response.status_code != 200:
+                    response_time = time.time() - start_time
+                    stats = {
+                        'response_time': response_time,
+                        'status_code': response.status_code,
+                        'error': f"HTTP {response.status_code}: {response.text}",
+                        'success': False
+                    }
+                    return None, response_time, stats
+                
+                ttft = None
+                if stream:
+                    # 逐行解析NDJSON，最后一个块(done=true)携带Ollama的计数器
+                    text_parts = []
+                    result = {}
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line:
+                            continue
+                        chunk = json.loads(line)
+                        if ttft is None:
+                            ttft = time.time() - start_time
+                        text_parts.append(chunk.get('response', ''))
+                        if chunk.get('done'):
+                            result = chunk
+                            break
+                    generated_text = ''.join(text_parts)
+                else:
+                    result = response.json()
+                    generated_text = result.get('response', '')
             
-            end_time = time.time()
-            response_time = end_time - start_time
+            response_time = time.time() - start_time
             
-            if response.status_code == 200:
-                result = response.json()
-                generated_text = result.get('response', '')
-                
-                # 性能统计
-                stats = {
-                    'response_time': response_time,
-                    'status_code': response.status_code,
-                    'response_length': len(generated_text),
-                    'tokens_per_second': len(generated_text.split()) / response_time if response_time > 0 else 0,
-                    'success': True
-                }
-                
-                return generated_text, response_time, stats
+            # 优先使用Ollama原生计数器计算生成速度，缺失时按词数估算
+            eval_count = result.get('eval_count')
+            eval_duration = result.get('eval_duration')
+            if eval_count and eval_duration:
+                tokens_per_second = eval_count / (eval_duration / 1e9)
             else:
-                stats = {
-                    'response_time': response_time,
-                    'status_code': response.status_code,
-                    'error': f"HTTP {response.status_code}: {response.text}",
-                    'success': False
-                }
-                return None, response_time, stats
+                tokens_per_second = len(generated_text.split()) / response_time if response_time > 0 else 0
+            
+            # 性能统计
+            stats = {
+                'response_time': response_time,
+                'status_code': response.status_code,
+                'response_length': len(generated_text),
+                'tokens_per_second': tokens_per_second,
+                'eval_count': eval_count,
+                'ttft': ttft,
+                'success': True
+            }
+            
+            return generated_text, response_time, stats
                 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, ValueError) as e:
             end_time = time.time()
             response_time = end_time - start_time
+            if self._is_read_timeout(e):
+                error = f"读取超时 (>{self.READ_TIMEOUT:.0f}秒未收到数据)"
+            else:
+                error = str(e)
             stats = {
                 'response_time': response_time,
-                'error': str(e),
+                'error': error,
                 'success': False
             }
             return None, response_time, stats
 
+    @staticmethod
+    def _is_read_timeout(error: Exception) -> bool:
+        """判断是否为读取超时：流式读取期间的超时会被requests包装成ConnectionError"""
+        if isinstance(error, requests.exceptions.ReadTimeout):
+            return True
+        if isinstance(error, requests.exceptions.ConnectionError):
+            cause = error.args[0] if error.args else None
+            return isinstance(cause, ReadTimeoutError) or "Read timed out" in str(error)
+        return False
+
 class OllamaTestSuite:
     """Ollama测试套件"""
     
     def __init__(self, client: OllamaTestClient):
         self.client = client
         self.test_results = []
+        self._semaphore = threading.Semaphore(MAX_CONCURRENT_TESTS)
+        self._rate_lock = threading.Lock()
+        self._next_request_time = 0.0
+        
+        # 解析一次服务器主机和端口（兼容IPv6及带路径的URL）
+        url = urlsplit(client.base_url)
+        self.host = url.hostname
+        self.port = url.port or (443 if url.scheme == "https" else 80)
         
     def run_all_tests(self) -> Dict:
         """运行所有测试"""
@@ -219,12 +346,11 @@ class OllamaTestSuite:
         
         # 0. 网络诊断
         print("\n🔍 0. 网络连接诊断...")
-        host = self.client.base_url.replace("http://", "").replace("https://", "").split(":")[0]
-        port = int(self.client.base_url.split(":")[-1]) if ":" in self.client.base_url.split("//")[1] else 80
+        host, port = self.host, self.port
         
-        # Ping测试
-        ping_success, ping_msg, ping_time = NetworkDiagnostics.ping_host(host)
-        print(f"   Ping测试: {'✅' if ping_success else '❌'} {ping_msg} ({ping_time:.1f}ms)")
+        # 主机连通性测试（TCP探测）
+        ping_success, ping_msg, ping_time = NetworkDiagnostics.ping_host(host, port)
+        print(f"   主机探测: {'✅' if ping_success else '❌'} {ping_msg} ({ping_time:.1f}ms)")
         
         # 端口测试
         port_open, port_msg, connect_time = NetworkDiagnostics.check_port(host, port)
@@ -260,93 +386,65 @@ class OllamaTestSuite:
         
         print(f"\n📝 2. 开始执行 {len(test_questions)} 个复杂测试问题...")
         
-        for i, (category, question) in enumerate(test_questions, 1):
-            print(f"\n   测试 {i}/{len(test_questions)} - {category}")
-            print(f"   问题: {question[:100]}{'...' if len(question) > 100 else ''}")
-            
-            response, response_time, stats = self.client.generate_response(question)
-            
-            test_result = {
-                'test_id': i,
-                'category': category,
-                'question': question,
-                'response': response,
-                'stats': stats,
-                'timestamp': datetime.now().isoformat()
-            }
-            
-            self.test_results.append(test_result)
-            
-            if stats['success']:
-                print(f"   ✅ 响应时间: {response_time:.2f}秒")
-                print(f"   📊 响应长度: {stats['response_length']} 字符")
-                print(f"   ⚡ 处理速度: {stats['tokens_per_second']:.1f} 词/秒")
-            else:
-                print(f"   ❌ 测试失败: {stats.get('error', '未知错误')}")
+        # 并发发起测试请求，按完成顺序输出结果
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_TESTS) as executor:
+            futures = [
+                executor.submit(self._run_one, i, category, question)
+                for i, (category, question) in enumerate(test_questions, 1)
+            ]
+            for future in as_completed(futures):
+                test_result = future.result()
+                self.test_results.append(test_result)
+                self._print_test_result(test_result, len(test_questions))
+        
+        self.test_results.sort(key=lambda r: r['test_id'])
         
         # 3. 生成测试报告
         return self._generate_report()
     
-    def _get_test_questions(self) -> List[Tuple[str, str]]:
+    def _wait_for_rate_limit(self):
+        """限制相邻请求的最小发起间隔"""
+        with self._rate_lock:
+            now = time.monotonic()
+            wait_time = self._next_request_time - now
+            self._next_request_time = max(now, self._next_request_time) + MIN_REQUEST_INTERVAL
+        if wait_time > 0:
+            time.sleep(wait_time)
+    
+    def _run_one(self, test_id: int, category: str, question: str) -> Dict:
+        """执行单个测试问题"""
+        with self._semaphore:
+            self._wait_for_rate_limit()
+            response, response_time, stats = self.client.generate_response(question)
+        
+        return {
+            'test_id': test_id,
+            'category': category,
+            'question': question,
+            'response': response,
+            'stats': stats,
+            'timestamp': datetime.now().isoformat()
+        }
+    
+    def _print_test_result(self, test_result: Dict, total: int):
+        """打印单个测试结果"""
+        question = test_result['question']
+        stats = test_result['stats']
+        print(f"\n   测试 {test_result['test_id']}/{total} - {test_result['category']}")
+        print(f"   问题: {question[:100]}{'...' if len(question) > 100 else ''}")
+        
+        if stats['success']:
+            print(f"   ✅ 响应时间: {stats['response_time']:.2f}秒")
+            print(f"   📊 响应长度: {stats['response_length']} 字符")
+            print(f"   ⚡ 处理速度: {stats['tokens_per_second']:.1f} tokens/秒")
+            if stats.get('ttft') is not None:
+                print(f"   ⏱️  首token延迟: {stats['ttft']:.2f}秒")
+        else:
+            print(f"   ❌ 测试失败: {stats.get('error', '未知错误')}")
+    
+    def _get_test_questions(self) -> Tuple[Tuple[str, str], ...]:
         """获取5个复杂测试问题"""
-        return [
-            ("逻辑推理", 
-             """有一个古老的逻辑谜题：在一个小镇上，有一位理发师，他只给那些不给自己理发的人理发。
-             请分析这个悖论的逻辑结构，解释为什么这是一个自相矛盾的陈述，并提出至少三种可能的解决方案。
-             同时，请将这个问题与罗素悖论进行比较，说明它们在数学逻辑中的意义。"""),
-            
-            ("创意写作", 
-             """请创作一个科幻短故事（500-800字），故事背景设定在2080年，人类已经实现了意识上传技术。
-             主角是一名数据考古学家，专门研究被遗忘的数字文明遗迹。故事要包含以下元素：
-             1. 一个关于人工智能觉醒的秘密
-             2. 时间悖论的概念
-             3. 对人性本质的深度思考
-             请确保故事有完整的情节结构和深刻的哲学内涵。"""),
-            
-            ("数据分析", 
-             """假设你是一名数据科学家，需要分析一个电商平台的用户行为数据。给定以下信息：
-             - 平台有100万活跃用户
-             - 平均每用户每月访问15次
-             - 转化率为3.2%
-             - 平均订单价值为156元
-             - 用户留存率：1个月85%，3个月62%，12个月34%
-             
-             请设计一个完整的分析框架来：
-             1. 识别高价值用户群体
-             2. 预测用户流失风险
-             3. 制定个性化营销策略
-             4. 估算不同策略的ROI
-             并解释你的分析方法和预期结果。"""),
-            
-            ("技术架构", 
-             """设计一个支持千万级用户的实时聊天系统架构。系统需要满足以下要求：
-             1. 支持文本、图片、语音、视频消息
-             2. 消息送达率99.9%以上
-             3. 消息延迟小于100ms
-             4. 支持群聊（最多1000人）
-             5. 消息加密和隐私保护
-             6. 跨平台兼容（Web、iOS、Android）
-             
-             请详细说明：
-             - 整体架构设计（包括微服务拆分）
-             - 数据库设计和分片策略
-             - 消息队列和实时通信方案
-             - 负载均衡和容灾机制
-             - 安全和隐私保护措施
-             - 性能优化策略"""),
-            
-            ("哲学思辨", 
-             """探讨人工智能时代的伦理问题：当AI系统的决策能力超越人类时，我们应该如何定义责任和道德？
-             
-             请从以下角度进行深入分析：
-             1. 道德主体性：AI是否可以成为道德主体？
-             2. 责任归属：AI造成的伤害应该由谁承担责任？
-             3. 决策透明度：AI的"黑盒"决策是否违背了道德原则？
-             4. 人类尊严：AI的超越是否威胁到人类的内在价值？
-             5. 未来社会：在AI主导的社会中，人类的角色是什么？
-             
-             请结合具体案例，提出你的观点和解决方案，并考虑不同文化背景下的伦理差异。""")
-        ]
+        return TEST_QUESTIONS
     
     def _generate_report(self) -> Dict:
         """生成详细的测试报告"""
@@ -357,6 +455,7 @@ class OllamaTestSuite:
             response_times = [r['stats']['response_time'] for r in successful_tests]
             response_lengths = [r['stats']['response_length'] for r in successful_tests]
             tokens_per_second = [r['stats']['tokens_per_second'] for r in successful_tests]
+            ttfts = [r['stats']['ttft'] for r in successful_tests if r['stats'].get('ttft') is not None]
             
             performance_stats = {
                 'avg_response_time': statistics.mean(response_times),
@@ -364,7 +463,8 @@ class OllamaTestSuite:
                 'max_response_time': max(response_times),
                 'median_response_time': statistics.median(response_times),
                 'avg_response_length': statistics.mean(response_lengths),
-                'avg_tokens_per_second': statistics.mean(tokens_per_second)
+                'avg_tokens_per_second': statistics.mean(tokens_per_second),
+                'avg_ttft': statistics.mean(ttfts) if ttfts else None
             }
         else:
             performance_stats = {}
@@ -399,7 +499,9 @@ class OllamaTestSuite:
             print(f"   响应时间范围: {stats['min_response_time']:.2f}s - {stats['max_response_time']:.2f}s")
             print(f"   中位响应时间: {stats['median_response_time']:.2f}秒")
             print(f"   平均响应长度: {stats['avg_response_length']:.0f} 字符")
-            print(f"   平均处理速度: {stats['avg_tokens_per_second']:.1f} 词/秒")
+            print(f"   平均处理速度: {stats['avg_tokens_per_second']:.1f} tokens/秒")
+            if stats['avg_ttft'] is not None:
+                print(f"   平均首token延迟: {stats['avg_ttft']:.2f}秒")
         
         print(f"\n📝 详细结果:")
         for result in report['test_results']:
@@ -426,8 +528,12 @@ def main():
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         result_file = f"ollama_test_results_{timestamp}.json"
         
-        with open(result_file, 'w', encoding='utf-8') as f:
-            json.dump(results, f, ensure_ascii=False, indent=2)
+        if orjson is not None:
+            with open(result_file, 'wb') as f:
+                f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+        else:
+            with open(result_file, 'w', encoding='utf-8') as f:
+                json.dump(results, f, ensure_ascii=False, indent=2)
         
         print(f"\n💾 测试结果已保存到: {result_file}")
         